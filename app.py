@@ -10,12 +10,107 @@ import requests
 import unicodedata
 import json
 import numpy as np
+import threading
+import re
+from functools import lru_cache, partial, wraps
+from array import array
+import bisect
+import hashlib
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # Sin pyarrow no hay snapshot en disco ni exportación Parquet; la app sigue funcionando
+    pa = feather = pq = None
+try:
+    import openpyxl
+except ImportError:  # Sin openpyxl la importación masiva acepta solo CSV
+    openpyxl = None
+import io
+import csv
+import os
+import sqlite3
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # --- 1. CONFIGURACIÓN Y CONSTANTES ---
 URL_GITHUB_GEO = "https://github.com/xammyvictor/FORMULARIO/blob/main/co_2018_MGN_MPIO_POLITICO.geojson"
 META_REGISTROS = 12000
 USUARIOS_ADMIN = ["fabian", "xammy", "brayan"]
 MUNICIPIOS_VALLE_TOTAL = 42
+NOMBRE_HOJA = "Base_Datos_Ciudadanos"
+INTERVALO_DELTA_SEG = 20        # Espera mínima entre consultas de filas nuevas
+INTERVALO_RESYNC_SEG = 900      # Recarga completa de la hoja cada 15 minutos
+DIR_APP = os.path.dirname(os.path.abspath(__file__))
+DIR_DATOS = os.path.join(DIR_APP, ".pulse_data")
+RUTA_GEOJSON_PAIS = os.path.join(DIR_APP, "co_2018_MGN_MPIO_POLITICO.geojson")
+DIR_GEO = os.path.join(DIR_DATOS, "geo")
+DPTO_VALLE = "76"
+PROPIEDADES_GEO = ["DPTO_CCDGO", "MPIO_CCDGO", "MPIO_CCNCT", "MPIO_CNMBR"]
+VERSION_GEO = 4                 # Subir al cambiar el formato de los artefactos geográficos
+# Niveles de detalle del mapa: tolerancia Douglas-Peucker en grados
+NIVELES_GEO = {"completo": 0.0, "medio": 0.002, "bajo": 0.008}
+DECIMALES_GEO = (6, 5, 4, 3)    # Precisiones de coordenadas escritas por cada nivel
+PIXELES_TOLERANCIA = 1.0        # Error máximo admitido en pantalla al elegir nivel
+ALTO_MAPA_PX = 1000
+MEMORIA_CACHE_FIGURAS_MB = 64   # JSON de figuras de mapa memorizado por contenido (LRU)
+ENTRADAS_CACHE_FIGURAS = 64
+# Refresco automático (segundos) de cada sección del tablero de estadísticas
+INTERVALOS_SECCION = {"kpis": 30, "mapa": 300, "ranking": 60, "leaderboard": 60, "tendencia": 300, "detalle": 120,
+                      "exportacion": 2}
+PERIODOS_DETALLE = ["Todo", "Esta semana", "Últimos 30 días"]
+ALTO_MAPA_DETALLE_PX = 520
+PUNTOS_TENDENCIA = 400          # Máximo de puntos dibujados en la tendencia (LTTB por encima)
+# Granularidad de la tendencia según el rango visible: (frecuencia, días máximos del rango)
+GRANULARIDADES_TENDENCIA = [("h", 14), ("D", 730), ("W", None)]
+RUTA_JOURNAL = os.path.join(DIR_DATOS, "journal.db")
+RUTA_SNAPSHOT = os.path.join(DIR_DATOS, "snapshot.arrow")
+VERSION_SNAPSHOT = 3            # Subir si cambia el formato del snapshot en disco
+INTERVALO_SNAPSHOT_SEG = 60     # Frecuencia máxima de escritura del snapshot
+BACKEND_ALMACENAMIENTO = os.environ.get("PULSE_BACKEND", "sheets")  # "sheets" o "sqlite"
+RUTA_SQLITE = os.path.join(DIR_DATOS, "registros.db")
+# Fragmentación del libro de Sheets: "" (todo en sheet1), "mes" o "municipio"
+FRAGMENTACION_HOJA = os.environ.get("PULSE_FRAGMENTACION", "")
+PREFIJO_FRAGMENTO = "Registros "  # Hojas fragmento: "Registros 2026-10", "Registros TULUA"
+HILOS_FRAGMENTOS = 4              # Lecturas simultáneas de fragmentos (cuota de la API)
+DIR_FRAGMENTOS = os.path.join(DIR_DATOS, "fragmentos")
+COLUMNAS_REGISTRO = ["Fecha Registro", "Registrado Por", "Nombre", "Cédula", "Teléfono",
+                     "Ocupación", "Dirección", "Barrio", "Ciudad", "Puesto"]
+CAMPOS_BUSQUEDA = ["Nombre", "Cédula", "Teléfono", "Barrio", "Ciudad"]
+# Explorador: columnas visibles por defecto y filas por página (solo la página viaja al navegador)
+COLUMNAS_RESULTADO = ["Fecha Registro", "Nombre", "Cédula", "Teléfono", "Barrio", "Ciudad", "Registrado Por"]
+TAMANOS_PAGINA = [25, 50, 100, 250]
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"  # Como save_data escribe Fecha Registro
+COLUMNAS_CATEGORICAS = ["Ciudad", "Registrado Por", "Ocupación", "Barrio"]
+COLUMNAS_ENTERAS = ["Cédula", "Teléfono"]
+LOTE_ESCRITURA = 200            # Filas máximas por llamada a append_rows
+REINTENTO_BASE_SEG = 2          # Backoff exponencial ante fallos de la API
+REINTENTO_MAX_SEG = 120
+LOTE_IMPORTACION = 2000         # Filas por bloque leído, validado y confirmado en la importación masiva
+# Encabezados aceptados en archivos de importación (normalizados) -> campo del formulario
+ALIAS_IMPORTACION = {
+    "NOMBRE": "nombre", "NOMBRE COMPLETO": "nombre", "NOMBRES Y APELLIDOS": "nombre",
+    "CEDULA": "cedula", "DOCUMENTO": "cedula", "CC": "cedula", "NUMERO DE DOCUMENTO": "cedula",
+    "TELEFONO": "telefono", "CELULAR": "telefono", "TEL": "telefono",
+    "OCUPACION": "ocupacion", "DIRECCION": "direccion", "BARRIO": "barrio",
+    "MUNICIPIO": "ciudad", "CIUDAD": "ciudad", "PUESTO": "puesto", "PUESTO DE VOTACION": "puesto",
+    "REGISTRADO POR": "registrado_por", "LIDER": "registrado_por",
+}
+LOTE_EXPORTACION = 5000         # Filas por bloque escrito al exportar
+DIR_EXPORTACIONES = os.path.join(DIR_DATOS, "exportaciones")
+VIGENCIA_EXPORTACION_SEG = 3600 # Los archivos exportados se borran pasada una hora
+EXPORTACIONES_SIMULTANEAS = 2
+# Formato visible -> (extensión, tipo MIME)
+FORMATOS_EXPORTACION = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+MUESTRAS_METRICAS = 200         # Mediciones recientes conservadas por etapa (percentiles y logs)
+
+log = logging.getLogger("pulse")
 
 st.set_page_config(
     page_title="Maria Irma | Pulse Analytics",
@@ -25,45 +120,59 @@ st.set_page_config(
 )
 
 # --- 2. FUNCIONES DE NORMALIZACIÓN ---
-def normalizar(texto):
-    """Limpia el texto de tildes, espacios y lo pasa a mayúsculas."""
-    if not texto: return ""
-    texto = str(texto).upper().strip()
+TAMANO_CACHE_NORMALIZACION = 8192  # Valores distintos memorizados por función
+
+# Nombres de entrada frecuentes -> identificación oficial del DANE
+MAPEO_MUNICIPIOS = {
+    "BUGA": "GUADALAJARA DE BUGA",
+    "JAMUNDI": "JAMUNDI",
+    "TULUA": "TULUA",
+    "GUACARI": "GUACARI",
+    "DARIEN": "CALIMA",
+    "CALIMA": "CALIMA",
+    "LA UNION": "LA UNION",
+    "RIOFRIO": "RIOFRIO",
+    "ANDALUCIA": "ANDALUCIA",
+    "YUMBO": "YUMBO",
+    "PALMIRA": "PALMIRA",
+    "DAGUA": "DAGUA",
+    "CARTAGO": "CARTAGO",
+    "EL CERRITO": "EL CERRITO",
+    "BUGALAGRANDE": "BUGALAGRANDE",
+    "CAICEDONIA": "CAICEDONIA",
+    "FLORIDA": "FLORIDA",
+    "GINEBRA": "GINEBRA",
+    "PRADERA": "PRADERA",
+    "RESTREPO": "RESTREPO",
+    "ROLDANILLO": "ROLDANILLO",
+    "SEVILLA": "SEVILLA",
+    "SANTIAGO DE CALI": "CALI",
+    "CALI": "CALI",
+    "ZARZAL": "ZARZAL"
+}
+
+@lru_cache(maxsize=TAMANO_CACHE_NORMALIZACION)
+def _normalizar_texto(texto):
+    texto = texto.upper().strip()
     texto = unicodedata.normalize("NFD", texto)
     texto = "".join(c for c in texto if unicodedata.category(c) != "Mn")
     return " ".join(texto.split())
 
-def normalizar_para_mapa(muni):
-    """Mapea nombres de entrada a la identificación oficial del DANE."""
-    m = normalizar(muni)
-    mapping = {
-        "BUGA": "GUADALAJARA DE BUGA",
-        "JAMUNDI": "JAMUNDI",
-        "TULUA": "TULUA",
-        "GUACARI": "GUACARI",
-        "DARIEN": "CALIMA",
-        "CALIMA": "CALIMA",
-        "LA UNION": "LA UNION",
-        "RIOFRIO": "RIOFRIO",
-        "ANDALUCIA": "ANDALUCIA",
-        "YUMBO": "YUMBO",
-        "PALMIRA": "PALMIRA",
-        "DAGUA": "DAGUA",
-        "CARTAGO": "CARTAGO",
-        "EL CERRITO": "EL CERRITO",
-        "BUGALAGRANDE": "BUGALAGRANDE",
-        "CAICEDONIA": "CAICEDONIA",
-        "FLORIDA": "FLORIDA",
-        "GINEBRA": "GINEBRA",
-        "PRADERA": "PRADERA",
-        "RESTREPO": "RESTREPO",
-        "ROLDANILLO": "ROLDANILLO",
-        "SEVILLA": "SEVILLA",
-        "SANTIAGO DE CALI": "CALI",
-        "CALI": "CALI",
-        "ZARZAL": "ZARZAL"
-    }
-    return mapping.get(m, m)
+def normalizar(texto):
+    """Limpia el texto de tildes, espacios y lo pasa a mayúsculas."""
+    if not texto: return ""
+    return _normalizar_texto(str(texto))
+
+def normalizar_serie(serie, funcion=normalizar):
+    """Aplica la normalización solo a los valores distintos de la serie.
+
+    factorize reduce la columna a sus valores únicos; la función (memorizada)
+    se evalúa sobre ellos y el resultado se expande de vuelta con take.
+    """
+    codigos, unicos = pd.factorize(serie)
+    if len(unicos) == 0: return pd.Series([""] * len(serie), index=serie.index, dtype=object)
+    normalizados = np.array([funcion(u) for u in unicos] + [""], dtype=object)
+    return pd.Series(normalizados[codigos], index=serie.index)  # El código -1 (nulo) cae en ""
 
 # --- 3. ESTILOS VISUALES ---
 def apply_custom_styles():
@@ -142,7 +251,145 @@ def apply_custom_styles():
         </style>
     """, unsafe_allow_html=True)
 
-# --- 4. CONEXIÓN A DATOS ---
+# --- 4. INSTRUMENTACIÓN ---
+class Metricas:
+    """Tiempos por etapa, contadores, tasas de acierto de caché y tamaños de carga.
+
+    Las etapas son fetch (hoja/base), parse (filas -> DataFrame), aggregate
+    (contadores e índices), geometry (GeoJSON), render (figuras y secciones) y
+    write (cola de escritura y snapshot); `parte` distingue el sitio exacto.
+    Es un objeto por proceso: lo comparten todas las sesiones y los hilos.
+    """
+    ETAPAS = ("fetch", "parse", "aggregate", "geometry", "render", "write")
+
+    def __init__(self, muestras=MUESTRAS_METRICAS):
+        self.lock = threading.Lock()
+        self.muestras = muestras
+        self.inicio = time.time()
+        self.tiempos = {}      # (etapa, parte) -> [n, suma, máximo, deque de segundos recientes]
+        self.contadores = {}   # nombre -> entero acumulado
+        self.tamanos = {}      # nombre -> bytes de la última carga
+        self.eventos = deque(maxlen=muestras * 4)  # Registros estructurados para exportar
+        self.lru = {}          # nombre -> función con lru_cache (se reporta con cache_info)
+
+    @contextmanager
+    def medir(self, etapa, parte=""):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.registrar(etapa, parte, time.perf_counter() - t0)
+
+    def medido(self, etapa, parte):
+        """Decorador equivalente a `with medir(etapa, parte)` sobre toda la función."""
+        def decorador(funcion):
+            @wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with self.medir(etapa, parte): return funcion(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    def contar_cache(self, nombre):
+        """Decorador externo a st.cache_*: cuenta consultas. El cuerpo memorizado
+        marca sus fallos con cache_fallo; la diferencia son los aciertos."""
+        def decorador(funcion):
+            @wraps(funcion)
+            def envoltura(*args, **kwargs):
+                self.contar(f"cache_{nombre}_llamada")
+                return funcion(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    def cache_fallo(self, nombre):
+        self.contar(f"cache_{nombre}_fallo")
+
+    def registrar(self, etapa, parte, segundos):
+        with self.lock:
+            n, suma, maximo, recientes = self.tiempos.get((etapa, parte)) or (0, 0.0, 0.0, deque(maxlen=self.muestras))
+            recientes.append(segundos)
+            self.tiempos[(etapa, parte)] = [n + 1, suma + segundos, max(maximo, segundos), recientes]
+            self.eventos.append({"ts": time.time(), "tipo": "tiempo", "etapa": etapa, "parte": parte, "seg": round(segundos, 6)})
+
+    def contar(self, nombre, n=1):
+        with self.lock: self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def tamano(self, nombre, n_bytes):
+        with self.lock:
+            self.tamanos[nombre] = int(n_bytes)
+            self.eventos.append({"ts": time.time(), "tipo": "bytes", "nombre": nombre, "bytes": int(n_bytes)})
+
+    def error(self, donde, exc):
+        """Reemplaza los `except: pass`: el fallo se cuenta y queda en el log con traza."""
+        self.contar(f"error_{donde}")
+        log.warning("Fallo en %s: %s", donde, exc, exc_info=exc)
+        with self.lock:
+            self.eventos.append({"ts": time.time(), "tipo": "error", "donde": donde, "error": repr(exc)})
+
+    def tasas_cache(self):
+        """{nombre: (aciertos, fallos)}; incluye los lru_cache de normalización."""
+        tasas = {}
+        with self.lock:
+            for clave, n in self.contadores.items():
+                if clave.startswith("cache_") and clave.endswith("_llamada"):
+                    nombre = clave[6:-8]
+                    fallos = self.contadores.get(f"cache_{nombre}_fallo", 0)
+                    tasas[nombre] = (max(n - fallos, 0), fallos)
+        for nombre, funcion in self.lru.items():
+            info = funcion.cache_info()
+            tasas[nombre] = (info.hits, info.misses)
+        return tasas
+
+    def resumen(self):
+        with self.lock:
+            filas = []
+            for (etapa, parte), (n, suma, maximo, recientes) in self.tiempos.items():
+                r = sorted(recientes)
+                filas.append({"etapa": etapa, "parte": parte, "n": n, "total_seg": suma,
+                              "media_ms": suma / n * 1000, "p50_ms": r[len(r) // 2] * 1000,
+                              "p95_ms": r[min(int(len(r) * 0.95), len(r) - 1)] * 1000, "max_ms": maximo * 1000})
+            contadores = dict(self.contadores)
+            tamanos = dict(self.tamanos)
+        orden = {e: i for i, e in enumerate(self.ETAPAS)}
+        filas.sort(key=lambda f: (orden.get(f["etapa"], len(orden)), -f["total_seg"]))
+        return {"desde": self.inicio, "etapas": filas, "contadores": contadores, "bytes": tamanos,
+                "cache": {k: {"aciertos": a, "fallos": f, "tasa": a / (a + f) if a + f else None}
+                          for k, (a, f) in self.tasas_cache().items()}}
+
+    def exportar_json(self):
+        """Líneas JSON (una por evento) más una línea final con el resumen."""
+        with self.lock: eventos = list(self.eventos)
+        lineas = [json.dumps(e, ensure_ascii=False) for e in eventos]
+        lineas.append(json.dumps({"tipo": "resumen", "ts": time.time(), **self.resumen()}, ensure_ascii=False))
+        return "\n".join(lineas) + "\n"
+
+    def exportar_prometheus(self):
+        """Formato de exposición de texto de Prometheus."""
+        r = self.resumen()
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"')
+        out = ["# TYPE pulse_etapa_segundos summary"]
+        for f in r["etapas"]:
+            et = f'etapa="{esc(f["etapa"])}",parte="{esc(f["parte"])}"'
+            out.append(f'pulse_etapa_segundos{{{et},quantile="0.5"}} {f["p50_ms"] / 1000:.6f}')
+            out.append(f'pulse_etapa_segundos{{{et},quantile="0.95"}} {f["p95_ms"] / 1000:.6f}')
+            out.append(f'pulse_etapa_segundos_sum{{{et}}} {f["total_seg"]:.6f}')
+            out.append(f'pulse_etapa_segundos_count{{{et}}} {f["n"]}')
+        out.append("# TYPE pulse_eventos_total counter")
+        out += [f'pulse_eventos_total{{nombre="{esc(k)}"}} {v}' for k, v in sorted(r["contadores"].items())
+                if not k.startswith("cache_")]
+        out.append("# TYPE pulse_cache_total counter")
+        for k, c in sorted(r["cache"].items()):
+            out.append(f'pulse_cache_total{{cache="{esc(k)}",resultado="acierto"}} {c["aciertos"]}')
+            out.append(f'pulse_cache_total{{cache="{esc(k)}",resultado="fallo"}} {c["fallos"]}')
+        out.append("# TYPE pulse_carga_bytes gauge")
+        out += [f'pulse_carga_bytes{{nombre="{esc(k)}"}} {v}' for k, v in sorted(r["bytes"].items())]
+        return "\n".join(out) + "\n"
+
+@st.cache_resource
+def get_metricas():
+    return Metricas()
+
+METRICAS = get_metricas()  # Misma instancia en cada reejecución del script
+METRICAS.lru = {"normalizar": _normalizar_texto}
+
+# --- 5. CONEXIÓN A DATOS ---
 @st.cache_resource
 def get_google_sheet_client():
     try:
@@ -152,59 +399,1944 @@ def get_google_sheet_client():
             scopes=["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
         )
         return gspread.authorize(creds)
-    except Exception: return None
+    except Exception as e:
+        METRICAS.error("credenciales", e)
+        return None
 
-def get_data():
+@st.cache_resource
+def get_libro():
+    """Abre el libro una sola vez por proceso (client.open consulta Drive)."""
     client = get_google_sheet_client()
-    if not client: return pd.DataFrame()
-    try:
-        sh = client.open("Base_Datos_Ciudadanos")
-        df = pd.DataFrame(sh.sheet1.get_all_records())
-        if not df.empty:
-            df['Fecha Registro'] = pd.to_datetime(df['Fecha Registro'], errors='coerce')
-            df.columns = [c.strip() for c in df.columns]
-        return df
-    except Exception: return pd.DataFrame()
+    if not client: return None
+    return client.open(NOMBRE_HOJA)
+
+def get_worksheet():
+    libro = get_libro()
+    return libro.sheet1 if libro else None
+
+def _bytes_celdas(filas):
+    """Tamaño aproximado del texto recibido (suma de longitudes de celda)."""
+    return sum(len(c) for f in filas for c in f)
+
+@METRICAS.medido("parse", "filas")
+def _filas_a_dataframe(encabezados, filas):
+    """Convierte filas crudas de la hoja en un DataFrame tipado, columna por columna.
+
+    Las filas se transponen una sola vez y cada columna nace con su tipo final
+    (ver _columna_tipada), sin un DataFrame intermedio de objetos por celda.
+    """
+    ancho = len(encabezados)
+    filas = [f if len(f) == ancho else list(f[:ancho]) + [""] * (ancho - len(f)) for f in filas]
+    df = pd.DataFrame({j: _columna_tipada(nombre, [f[j] for f in filas]) for j, nombre in enumerate(encabezados)})
+    df.columns = encabezados
+    return df
+
+def _columna_tipada(nombre, valores):
+    """Serie tipada a partir de los textos de una columna.
+
+    Esquema compacto: categorías para columnas de baja cardinalidad y enteros
+    para identificadores numéricos, siempre que todos los valores lo sean y
+    ninguno tenga ceros a la izquierda ("0123" no sobreviviría como 123).
+    Fecha Registro se interpreta con FORMATO_FECHA; solo las celdas que no lo
+    cumplen (ediciones manuales) pasan por la inferencia de formato.
+    """
+    if nombre == "Fecha Registro":
+        texto = pd.Series(valores, dtype=str)
+        fechas = pd.to_datetime(texto, format=FORMATO_FECHA, errors="coerce")
+        otras = fechas.isna() & (texto.str.strip() != "")
+        if otras.any():
+            fechas[otras] = pd.to_datetime(texto[otras], format="mixed", errors="coerce")
+        return fechas
+    if nombre in COLUMNAS_CATEGORICAS:
+        return pd.Series(pd.Categorical(valores))
+    if nombre in COLUMNAS_ENTERAS:
+        if all(v.isascii() and v.isdecimal() and len(v) <= 15 and (v[0] != "0" or len(v) == 1)
+               for v in valores):  # Sin vacíos ni espacios
+            return pd.Series(pd.array(np.array(valores, dtype="int64"), dtype="Int64"))
+        limpios = [str(v).strip() for v in valores]
+        if all(v == "" or (len(v) <= 15 and v.isascii() and v.isdecimal() and (v[0] != "0" or len(v) == 1))
+               for v in limpios):
+            vacios = np.array([v == "" for v in limpios], dtype=bool)
+            numeros = np.array([int(v) if v else 0 for v in limpios], dtype="int64")
+            return pd.Series(pd.arrays.IntegerArray(numeros, vacios))
+    return pd.Series(valores, dtype=str)
+
+def concatenar_registros(a, b):
+    """Concatena dos tramos tipados sin perder el esquema compacto.
+
+    pd.concat degrada a object las categorías con distinto vocabulario; aquí se
+    unifican las categorías, y si un identificador quedó entero en un tramo y
+    texto en el otro, la columna completa pasa a texto. No modifica a ni b.
+    """
+    if a.empty: return b
+    if b.empty: return a
+    columnas = {}
+    for col in a.columns:
+        x, y = a[col], b[col] if col in b.columns else pd.Series([None] * len(b))
+        if isinstance(x.dtype, pd.CategoricalDtype) and isinstance(y.dtype, pd.CategoricalDtype):
+            if not x.cat.categories.equals(y.cat.categories):
+                categorias = x.cat.categories.union(y.cat.categories)
+                x, y = x.cat.set_categories(categorias), y.cat.set_categories(categorias)
+        elif x.dtype != y.dtype and col in COLUMNAS_ENTERAS:
+            x, y = x.astype("string"), y.astype("string")
+        columnas[col] = pd.concat([x, y], ignore_index=True)
+    return pd.DataFrame(columnas)
+
+def concatenar_tramos(tramos):
+    """concatenar_registros sobre varios tramos, por pares: cada fila se copia
+    log2(k) veces en lugar de k."""
+    tramos = [t for t in tramos if not t.empty]
+    if not tramos: return pd.DataFrame()
+    while len(tramos) > 1:
+        tramos = [concatenar_registros(*tramos[i:i + 2]) if i + 1 < len(tramos) else tramos[i]
+                  for i in range(0, len(tramos), 2)]
+    return tramos[0]
+
+class CargadorIncremental:
+    """Conserva la última copia de la hoja y solo descarga las filas agregadas.
+
+    La hoja es de solo anexado (save_data), así que basta pedir el rango desde
+    la última fila conocida. Esa fila se vuelve a leer como testigo: si cambió
+    o desapareció, se hace una recarga completa. También hay recarga completa
+    cada INTERVALO_RESYNC_SEG para capturar ediciones manuales intermedias.
+
+    La copia se persiste como snapshot Arrow (ver SnapshotDisco): al reiniciar
+    se sirve de inmediato y la conciliación con la hoja corre en segundo plano.
+    Mientras un hilo consulta la hoja, los demás reciben la copia vigente.
+    """
+    def __init__(self, snapshot_disco=None):
+        self.lock = threading.Lock()
+        self.df = pd.DataFrame()
+        self.encabezados = []
+        self.filas = 0
+        self.ultima_fila = None
+        self.ultimo_resync = 0.0
+        self.ultimo_delta = 0.0
+        self.generacion = 0  # Cambia solo si una recarga completa no extiende la copia previa
+        self.huella = ""     # Hash encadenado (estable entre procesos) de las filas incorporadas
+        self.actual = None   # (df, generación) publicado; se reemplaza como una unidad
+        self.snapshot_disco = snapshot_disco
+        self.ultimo_guardado = 0.0
+        if snapshot_disco: self._restaurar()
+
+    def _publicar(self):
+        self.actual = (self.df, self.generacion)
+
+    def _restaurar(self):
+        estado = self.snapshot_disco.leer()
+        if not estado: return
+        self.df, meta = estado
+        self.encabezados = meta["encabezados"]
+        self.filas = meta["filas"]
+        self.ultima_fila = meta["ultima_fila"]
+        self.huella = meta["huella"]
+        self.generacion = 1
+        # Se sirve el snapshot ya; la hoja se concilia apenas llegue la primera consulta
+        self.ultimo_resync = self.ultimo_guardado = time.time()
+        self.ultimo_delta = 0.0
+        self._publicar()
+
+    def obtener(self, ws, forzar=False):
+        """Retorna (DataFrame, generación) consistentes entre sí."""
+        if self.actual is None or forzar:
+            with self.lock:
+                self._consultar(ws, forzar)
+                return self.actual
+        if not self._toca_consultar() or not self.lock.acquire(blocking=False):
+            return self.actual  # Copia vigente, u otro hilo ya está consultando
+        if self.ultimo_delta == 0.0:  # Recién restaurado del disco: se concilia en segundo plano
+            threading.Thread(target=self._conciliar, args=(ws,), daemon=True).start()
+        else:
+            self._conciliar(ws)
+        return self.actual
+
+    def _toca_consultar(self):
+        ahora = time.time()
+        return ahora - self.ultimo_resync >= INTERVALO_RESYNC_SEG or ahora - self.ultimo_delta >= INTERVALO_DELTA_SEG
+
+    def actualizar(self, ws):
+        """Consulta ya, sin esperar INTERVALO_DELTA_SEG (quien llama sabe que hubo cambios)."""
+        with self.lock:
+            self.ultimo_delta = min(self.ultimo_delta, time.time() - INTERVALO_DELTA_SEG)
+            self._consultar(ws)
+            return self.actual
+
+    def rango_testigo(self):
+        """Rango A1 con la última fila conocida y la siguiente; None si aún no hay copia."""
+        if not self.encabezados: return None
+        return f"A{self.filas + 1}:{self._columna_final()}{self.filas + 2}"
+
+    def sin_cambios(self, valores):
+        """True si la lectura de rango_testigo muestra la hoja tal como se cargó."""
+        if len(valores) != 1: return False
+        if not self.filas: return [c.strip() for c in valores[0]] == self.encabezados
+        return self._rellenar(valores[0]) == self.ultima_fila
+
+    def _conciliar(self, ws):
+        """Consulta con el lock ya tomado por obtener() y lo libera al terminar;
+        si la hoja falla se sigue sirviendo la última copia."""
+        try: self._consultar(ws)
+        except Exception as e: METRICAS.error("conciliar", e)
+        finally: self.lock.release()
+
+    def _consultar(self, ws, forzar=False):
+        ahora = time.time()
+        if forzar or not self.encabezados or ahora - self.ultimo_resync >= INTERVALO_RESYNC_SEG:
+            self._resync(ws)
+        elif ahora - self.ultimo_delta >= INTERVALO_DELTA_SEG:
+            if not self._delta(ws): self._resync(ws)
+        self._publicar()
+        if self.snapshot_disco and time.time() - self.ultimo_guardado >= INTERVALO_SNAPSHOT_SEG:
+            with METRICAS.medir("write", "snapshot"): self.snapshot_disco.escribir(self.df, {
+                "encabezados": self.encabezados, "filas": self.filas,
+                "ultima_fila": self.ultima_fila, "huella": self.huella})
+            self.ultimo_guardado = time.time()
+
+    def _resync(self, ws):
+        with METRICAS.medir("fetch", "hoja_completa"): valores = ws.get_all_values()
+        METRICAS.contar("filas_leidas", max(len(valores) - 1, 0))
+        METRICAS.tamano("hoja_completa", _bytes_celdas(valores))
+        encabezados = [c.strip() for c in valores[0]] if valores else []
+        filas = valores[1:]
+        self.ultimo_resync = self.ultimo_delta = time.time()
+        with METRICAS.medir("parse", "huella"):
+            extiende = bool(self.filas and encabezados == self.encabezados and len(filas) >= self.filas
+                            and self._huella(filas[:self.filas], "") == self.huella)
+        if extiende:
+            # Nada cambió en lo ya cargado: se conserva la generación y solo se anexa
+            self._anexar(filas[self.filas:])
+            return
+        self.encabezados = encabezados
+        self.df = _filas_a_dataframe(encabezados, filas) if encabezados else pd.DataFrame()
+        self.filas = len(filas)
+        self.ultima_fila = self._rellenar(filas[-1]) if filas else None
+        self.huella = self._huella(filas, "")
+        self.generacion += 1
+        self.ultimo_guardado = 0.0  # Reemplazo total: el snapshot en disco quedó obsoleto
+
+    def _huella(self, filas, inicial):
+        h = bytes.fromhex(inicial)
+        for f in filas:
+            h = hashlib.blake2b(h + "\x1f".join(map(str, self._rellenar(f))).encode(), digest_size=16).digest()
+        return h.hex()
+
+    def _anexar(self, nuevas):
+        if not nuevas: return
+        self.df = concatenar_registros(self.df, _filas_a_dataframe(self.encabezados, nuevas))
+        self.filas += len(nuevas)
+        self.ultima_fila = self._rellenar(nuevas[-1])
+        self.huella = self._huella(nuevas, self.huella)
+
+    def _delta(self, ws):
+        """Anexa las filas nuevas; devuelve False si detecta cambios previos."""
+        if self.filas == 0: return False
+        inicio = self.filas + 1  # Fila de la hoja con el último registro conocido
+        with METRICAS.medir("fetch", "delta"): bloque = ws.get(f"A{inicio}:{self._columna_final()}")
+        METRICAS.contar("filas_leidas", max(len(bloque) - 1, 0))
+        METRICAS.tamano("delta", _bytes_celdas(bloque))
+        if not bloque or self._rellenar(bloque[0]) != self.ultima_fila:
+            return False
+        self._anexar(bloque[1:])
+        self.ultimo_delta = time.time()
+        return True
+
+    def _columna_final(self):
+        return re.sub(r"\d", "", gspread.utils.rowcol_to_a1(1, len(self.encabezados)))
+
+    def _rellenar(self, fila):
+        ancho = len(self.encabezados)
+        return list(fila[:ancho]) + [""] * (ancho - len(fila))
+
+class SnapshotDisco:
+    """Copia columnar en disco (Arrow IPC sin compresión) con sello de versión.
+
+    Al arrancar, cada proceso convierte el archivo en su propio DataFrame (copia
+    privada: no comparte memoria con los demás) en lugar de descargar y parsear
+    la hoja; memory_map solo evita un búfer intermedio al leer. Los metadatos
+    del cargador viajan en el esquema.
+    """
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    def leer(self):
+        """Retorna (df, metadatos) o None si no hay snapshot compatible."""
+        if feather is None or not os.path.exists(self.ruta): return None
+        try:
+            with METRICAS.medir("fetch", "snapshot_disco"):
+                tabla = feather.read_table(self.ruta, memory_map=True)
+                meta = json.loads((tabla.schema.metadata or {}).get(b"pulse", b"{}"))
+                if meta.get("version") != VERSION_SNAPSHOT: return None
+                return tabla.to_pandas(), meta
+        except Exception as e:
+            METRICAS.error("snapshot_leer", e)
+            return None
+
+    def escribir(self, df, meta):
+        if feather is None or df.empty: return
+        try:
+            tabla = pa.Table.from_pandas(df, preserve_index=False)
+            sello = {**meta, "version": VERSION_SNAPSHOT, "creado": time.time()}
+            tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}),
+                                                   b"pulse": json.dumps(sello, ensure_ascii=False).encode()})
+            os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+            tmp = f"{self.ruta}.{os.getpid()}.tmp"
+            feather.write_feather(tabla, tmp, compression="uncompressed")
+            os.replace(tmp, self.ruta)
+            METRICAS.tamano("snapshot_disco", os.path.getsize(self.ruta))
+        except Exception as e: METRICAS.error("snapshot_escribir", e)
+
+@st.cache_resource
+def get_cargador():
+    return CargadorIncremental(SnapshotDisco(RUTA_SNAPSHOT))
+
+class PublicadorSnapshot:
+    """Único lector del backend por proceso; las sesiones solo leen lo publicado.
+
+    Un hilo consulta el origen cada `intervalo` segundos y, si la versión
+    (generación, filas) cambió, reemplaza la tupla (df, generación) publicada
+    y avisa a los suscriptores (índices y contadores derivados), que así se
+    ponen al día fuera del ciclo de render. Las vistas no reciben aviso: sus
+    fragmentos releen lo publicado en cada run_every. Lo publicado no se
+    modifica nunca: cada lectura nueva produce un DataFrame nuevo, así que las
+    sesiones lo usan sin copiarlo y no deben mutarlo.
+    """
+    def __init__(self, leer, intervalo=INTERVALO_DELTA_SEG):
+        self.leer = leer
+        self.intervalo = intervalo
+        self.lock_lectura = threading.Lock()  # Un solo viaje al origen a la vez
+        self.lock = threading.Lock()
+        self.despertar = threading.Event()
+        self.actual = None
+        self.version = (0, 0)
+        self.publicaciones = 0
+        self.suscriptores = {}  # nombre -> callback(df, generación)
+        self.hilo = None
+
+    def obtener(self, forzar=False):
+        if forzar or self.actual is None: self.refrescar(forzar)
+        return self.actual
+
+    def refrescar(self, forzar=False):
+        with self.lock_lectura:
+            if self.actual is not None and not forzar and threading.current_thread() is not self.hilo:
+                return  # Otra sesión ya hizo la primera lectura mientras esta esperaba
+            df, generacion = self.leer(forzar)
+        self._publicar(df, generacion)
+
+    def _publicar(self, df, generacion):
+        version = (generacion, len(df))
+        with self.lock:
+            if self.actual is not None and version == self.version: return
+            self.actual, self.version = (df, generacion), version
+            self.publicaciones += 1
+        METRICAS.contar("snapshots_publicados")
+        for nombre, callback in list(self.suscriptores.items()):
+            try: callback(df, generacion)
+            except Exception as e: METRICAS.error(f"suscriptor_{nombre}", e)
+
+    def suscribir(self, nombre, callback):
+        """Registra (o reemplaza, por nombre) un callback; si ya hay datos se llama de inmediato."""
+        self.suscriptores[nombre] = callback
+        if self.actual is not None: callback(*self.actual)
+
+    def _bucle(self):
+        while True:
+            self.despertar.wait(timeout=self.intervalo)
+            self.despertar.clear()
+            try: self.refrescar()
+            except Exception as e: METRICAS.error("refresco_snapshot", e)
+
+    def iniciar(self):
+        if self.hilo is None:
+            self.hilo = threading.Thread(target=self._bucle, name="pulse-refresco", daemon=True)
+            self.hilo.start()
+        return self
+
+class EscrituraParcial(Exception):
+    """anexar_filas confirmó solo parte del lote; `confirmadas` son sus posiciones."""
+    def __init__(self, confirmadas, causa):
+        super().__init__(f"{len(confirmadas)} filas confirmadas antes del fallo: {causa}")
+        self.confirmadas = confirmadas
+
+class BackendAlmacenamiento:
+    """Contrato de persistencia. Las agregaciones por defecto salen de contadores
+    materializados (AgregadosKPI) que siguen al snapshot; los motores SQL las
+    sobrescriben para resolverlas en la base.
+
+    Las subclases implementan leer(); las vistas usan snapshot(), que entrega la
+    copia publicada por el PublicadorSnapshot del proceso sin tocar el origen."""
+    def __init__(self):
+        self.publicador = PublicadorSnapshot(self.leer)
+
+    def leer(self, forzar=False):
+        """(DataFrame, generación). Dentro de una misma generación las filas solo
+        se anexan al final; un cambio de generación implica reemplazo total."""
+        raise NotImplementedError
+
+    def snapshot(self, forzar=False):
+        return self.publicador.obtener(forzar)
+
+    def anexar_filas(self, filas): raise NotImplementedError
+
+    def cargar(self, forzar=False):
+        return self.snapshot(forzar)[0]
+
+    def version(self):
+        """Clave barata que cambia cuando cambian los datos (para memorizar vistas)."""
+        if self.publicador.actual is None: self.snapshot()
+        return self.publicador.version
+
+    def agregados(self):
+        agregados = get_agregados_kpi()
+        agregados.sincronizar(*self.snapshot())
+        return agregados
+
+    def total(self):
+        return self.agregados().total
+
+    def conteo_rango(self, desde, hasta=None):
+        """Registros con desde <= Fecha Registro < hasta (resolución horaria)."""
+        return self.agregados().conteo_rango(desde, hasta)
+
+    def conteo_por_ciudad(self):
+        return self.agregados().tabla(self.agregados().por_ciudad, ['Ciudad', 'Registros'])
+
+    def ranking_lideres(self, limite=None):
+        return self.agregados().tabla(self.agregados().por_lider, ['Líder', 'Total'], limite)
+
+    def conteo_por_periodo(self, frecuencia, desde=None, hasta=None):
+        """Serie ['F_S', 'Ingresos'] por cubeta 'h', 'D' o 'W' dentro de [desde, hasta)."""
+        return self.agregados().serie(frecuencia, desde, hasta)
+
+    def extension_temporal(self):
+        """(primera, última) hora con registros, o (None, None)."""
+        return self.agregados().extension()
+
+class BackendGoogleSheets(BackendAlmacenamiento):
+    """Hoja de cálculo de Google; lectura incremental vía CargadorIncremental."""
+    def leer(self, forzar=False):
+        ws = get_worksheet()
+        if not ws: return pd.DataFrame(), 0
+        return get_cargador().obtener(ws, forzar)
+
+    def anexar_filas(self, filas):
+        ws = get_worksheet()
+        if not ws: raise RuntimeError("Sin conexión a Google Sheets")
+        ws.append_rows(filas)
+
+class BackendHojasFragmentadas(BackendAlmacenamiento):
+    """Registros repartidos en varias hojas del mismo libro, por mes o por municipio.
+
+    anexar_filas enruta cada fila a su hoja "Registros <clave>" (creándola si
+    falta) y leer() junta todas, incluida la hoja original, en una sola copia.
+    Cada fragmento tiene su propio CargadorIncremental y snapshot en disco.
+    Antes de consultarlos, una sola solicitud por lotes lee la fila testigo y la
+    siguiente de cada uno: los que no cambiaron se omiten y el resto se consulta
+    en paralelo con hasta HILOS_FRAGMENTOS hilos.
+
+    La copia combinada respeta el contrato de leer(): lo nuevo de cada fragmento
+    se anexa al final en orden de llegada, y solo si un fragmento cambia de
+    generación (edición manual) o desaparece se rearma todo con generación nueva.
+    """
+    def __init__(self, modo):
+        super().__init__()
+        self.modo = modo
+        self.lock = threading.Lock()
+        self.lock_hojas = threading.Lock()
+        self.hojas = {}        # título -> Worksheet
+        self.cargadores = {}   # título -> CargadorIncremental
+        self.incorporado = {}  # título -> (generación, filas) ya presentes en la copia combinada
+        self.df = pd.DataFrame()
+        self.generacion = 0
+        self.ejecutor = ThreadPoolExecutor(max_workers=HILOS_FRAGMENTOS, thread_name_prefix="pulse-fragmento")
+
+    def fragmento(self, fila):
+        """Título de la hoja destino de una fila con el layout de save_data."""
+        if self.modo == "mes":
+            clave = str(fila[0])[:7] or "SIN FECHA"
+        else:
+            resolvedor = get_resolvedor()
+            codigo = resolvedor.resolver(str(fila[8])) if resolvedor and len(fila) > 8 else None
+            clave = resolvedor.nombres[codigo] if codigo else "OTROS"
+        return PREFIJO_FRAGMENTO + clave
+
+    def _hoja(self, libro, titulo):
+        with self.lock_hojas:
+            ws = self.hojas.get(titulo)
+            if ws is None:
+                try: ws = libro.worksheet(titulo)
+                except gspread.exceptions.WorksheetNotFound:
+                    ws = libro.add_worksheet(titulo, rows=1000, cols=len(COLUMNAS_REGISTRO))
+                    ws.append_rows([COLUMNAS_REGISTRO])
+                    METRICAS.contar("fragmentos_creados")
+                self.hojas[titulo] = ws
+            return ws
+
+    def _cargador(self, titulo):
+        if titulo not in self.cargadores:
+            archivo = re.sub(r"\W+", "_", titulo).strip("_") + ".arrow"
+            self.cargadores[titulo] = CargadorIncremental(SnapshotDisco(os.path.join(DIR_FRAGMENTOS, archivo)))
+        return self.cargadores[titulo]
+
+    def anexar_filas(self, filas):
+        libro = get_libro()
+        if not libro: raise RuntimeError("Sin conexión a Google Sheets")
+        grupos = {}
+        for i, f in enumerate(filas): grupos.setdefault(self.fragmento(f), []).append(i)
+        confirmadas = []
+        for titulo, posiciones in grupos.items():
+            try: self._hoja(libro, titulo).append_rows([filas[i] for i in posiciones])
+            except Exception as e:
+                if not confirmadas: raise
+                raise EscrituraParcial(confirmadas, e) from e
+            confirmadas.extend(posiciones)
+
+    def leer(self, forzar=False):
+        libro = get_libro()
+        if not libro: return pd.DataFrame(), 0
+        with self.lock:
+            with METRICAS.medir("fetch", "lista_fragmentos"):
+                hojas = {ws.title: ws for ws in libro.worksheets()
+                         if ws.index == 0 or ws.title.startswith(PREFIJO_FRAGMENTO)}
+            with self.lock_hojas: self.hojas.update(hojas)
+            pendientes = hojas if forzar else self._cambiados(libro, hojas)
+            consultas = {t: self.ejecutor.submit(self._leer_fragmento, t, ws, forzar) for t, ws in pendientes.items()}
+            for titulo, consulta in consultas.items():
+                try: consulta.result()
+                except Exception as e: METRICAS.error(f"fragmento {titulo}", e)  # Se sirve su copia previa
+            self._combinar(sorted(hojas))
+            return self.df, self.generacion
+
+    def _cambiados(self, libro, hojas):
+        """Fragmentos a consultar: sin copia, con recarga completa vencida o cuyo testigo cambió."""
+        cambiados, candidatos, rangos = {}, [], []
+        ahora = time.time()
+        for titulo, ws in hojas.items():
+            cargador = self._cargador(titulo)
+            rango = cargador.rango_testigo()
+            if cargador.actual is None or rango is None or ahora - cargador.ultimo_resync >= INTERVALO_RESYNC_SEG:
+                cambiados[titulo] = ws
+            else:
+                candidatos.append(titulo)
+                rangos.append(gspread.utils.absolute_range_name(titulo, rango))
+        if rangos:
+            with METRICAS.medir("fetch", "testigos"): respuesta = libro.values_batch_get(rangos)
+            for titulo, rango in zip(candidatos, respuesta.get("valueRanges", [])):
+                if self.cargadores[titulo].sin_cambios(rango.get("values", [])):
+                    METRICAS.contar("fragmentos_omitidos")
+                else: cambiados[titulo] = hojas[titulo]
+        return cambiados
+
+    def _leer_fragmento(self, titulo, ws, forzar):
+        cargador = self._cargador(titulo)
+        with METRICAS.medir("fetch", "fragmento"):
+            return cargador.obtener(ws, True) if forzar else cargador.actualizar(ws)
+
+    def _combinar(self, titulos):
+        """Anexa lo nuevo de cada fragmento a la copia combinada, o la rearma."""
+        estados = {t: self.cargadores[t].actual for t in titulos if self.cargadores[t].actual is not None}
+        rearmar = bool(set(self.incorporado) - set(estados)) or any(
+            t in self.incorporado and (gen != self.incorporado[t][0] or len(df) < self.incorporado[t][1])
+            for t, (df, gen) in estados.items())
+        if rearmar or not self.generacion:
+            self.df, self.incorporado = pd.DataFrame(), {}
+            self.generacion += 1
+        tramos = []
+        for titulo, (df, gen) in estados.items():
+            previas = self.incorporado.get(titulo, (gen, 0))[1]
+            if len(df) > previas: tramos.append(df.iloc[previas:].reset_index(drop=True))
+            self.incorporado[titulo] = (gen, len(df))
+        if tramos: self.df = concatenar_tramos([self.df] + tramos)
+
+class BackendSQLite(BackendAlmacenamiento):
+    """Motor SQL embebido con el mismo layout de 10 columnas que escribe save_data.
+
+    Sirve para operar sin credenciales de Google y resuelve en SQL los conteos
+    del tablero. Fecha Registro se guarda como texto "%Y-%m-%d %H:%M:%S", que
+    ordena cronológicamente, así que las ventanas de fecha usan el índice.
+    """
+    CAMPOS = ["fecha_registro", "registrado_por", "nombre", "cedula", "telefono",
+              "ocupacion", "direccion", "barrio", "ciudad", "puesto"]
+
+    def __init__(self, ruta):
+        super().__init__()
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.df = pd.DataFrame(columns=COLUMNAS_REGISTRO)
+        self.ultimo_id = 0
+        self.generacion = 1
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as con:
+            campos = ", ".join(f"{c} TEXT NOT NULL DEFAULT ''" for c in self.CAMPOS)
+            con.execute(f"CREATE TABLE IF NOT EXISTS registros (id INTEGER PRIMARY KEY AUTOINCREMENT, {campos})")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_registros_fecha ON registros (fecha_registro)")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_registros_ciudad ON registros (ciudad)")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_registros_lider ON registros (registrado_por)")
+
+    def _conectar(self):
+        con = sqlite3.connect(self.ruta, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def _consultar(self, sql, params=()):
+        con = self._conectar()
+        try:
+            with METRICAS.medir("fetch", "sqlite"): return con.execute(sql, params).fetchall()
+        finally: con.close()
+
+    def leer(self, forzar=False):
+        """Copia en memoria para búsqueda; solo lee los id posteriores al último visto."""
+        with self.lock:
+            desde = 0 if forzar else self.ultimo_id
+            filas = self._consultar(f"SELECT id, {', '.join(self.CAMPOS)} FROM registros WHERE id > ? ORDER BY id", (desde,))
+            if filas or forzar:
+                nuevo = _filas_a_dataframe(COLUMNAS_REGISTRO, [f[1:] for f in filas])
+                self.df = nuevo if forzar or self.df.empty else concatenar_registros(self.df, nuevo)
+                if filas: self.ultimo_id = filas[-1][0]
+                if forzar: self.generacion += 1
+            return self.df, self.generacion
+
+    def anexar_filas(self, filas):
+        ancho = len(self.CAMPOS)
+        filas = [[str(v) for v in f[:ancho]] + [""] * (ancho - len(f)) for f in filas]
+        con = self._conectar()
+        try:
+            with con:
+                con.executemany(f"INSERT INTO registros ({', '.join(self.CAMPOS)}) VALUES ({', '.join('?' * ancho)})", filas)
+        finally: con.close()
+
+    def total(self):
+        return self._consultar("SELECT COUNT(*) FROM registros")[0][0]
+
+    def version(self):
+        return (self.generacion, self._consultar("SELECT COALESCE(MAX(id), 0) FROM registros")[0][0])
+
+    def conteo_rango(self, desde, hasta=None):
+        sql, params = "SELECT COUNT(*) FROM registros WHERE fecha_registro >= ?", [desde.strftime(FORMATO_FECHA)]
+        if hasta is not None:
+            sql += " AND fecha_registro < ?"
+            params.append(hasta.strftime(FORMATO_FECHA))
+        return self._consultar(sql, params)[0][0]
+
+    def conteo_por_ciudad(self):
+        filas = self._consultar("SELECT ciudad, COUNT(*) AS n FROM registros GROUP BY ciudad ORDER BY n DESC")
+        return pd.DataFrame(filas, columns=['Ciudad', 'Registros'])
+
+    def ranking_lideres(self, limite=None):
+        sql = "SELECT registrado_por, COUNT(*) AS n FROM registros GROUP BY registrado_por ORDER BY n DESC"
+        filas = self._consultar(sql + " LIMIT ?", (limite,)) if limite else self._consultar(sql)
+        return pd.DataFrame(filas, columns=['Líder', 'Total'])
+
+    def conteo_por_periodo(self, frecuencia, desde=None, hasta=None):
+        cubeta = {"h": "substr(fecha_registro, 1, 13) || ':00:00'", "D": "substr(fecha_registro, 1, 10)",
+                  "W": "date(substr(fecha_registro, 1, 10), '-6 days', 'weekday 1')"}[frecuencia]
+        condiciones, params = ["fecha_registro != ''"], []
+        if desde is not None:
+            condiciones.append("fecha_registro >= ?")
+            params.append(_inicio_cubeta(pd.Timestamp(desde), frecuencia).strftime(FORMATO_FECHA))
+        if hasta is not None:
+            # Igual que en las cubetas en memoria: entra completa toda cubeta que empiece antes de hasta
+            paso = {"h": pd.Timedelta(hours=1), "D": pd.Timedelta(days=1), "W": pd.Timedelta(days=7)}[frecuencia]
+            fin = _inicio_cubeta(pd.Timestamp(hasta) - pd.Timedelta(microseconds=1), frecuencia) + paso
+            condiciones.append("fecha_registro < ?")
+            params.append(fin.strftime(FORMATO_FECHA))
+        filas = self._consultar(f"SELECT {cubeta} AS c, COUNT(*) FROM registros "
+                                f"WHERE {' AND '.join(condiciones)} GROUP BY c", params)
+        conteos = {pd.to_datetime(c, errors="coerce"): n for c, n in filas}
+        conteos.pop(pd.NaT, None)
+        return completar_serie(conteos, frecuencia)
+
+    def extension_temporal(self):
+        inicio, fin = self._consultar("SELECT MIN(fecha_registro), MAX(fecha_registro) FROM registros "
+                                      "WHERE fecha_registro != ''")[0]
+        if inicio is None: return None, None
+        return pd.to_datetime(inicio, errors="coerce"), pd.to_datetime(fin, errors="coerce")
+
+@st.cache_resource
+def get_backend():
+    """Backend del proceso con su publicador en marcha; cada publicación pone al
+    día los derivados (los callbacks resuelven los singletons al ejecutarse)."""
+    if BACKEND_ALMACENAMIENTO == "sqlite":
+        backend = BackendSQLite(RUTA_SQLITE)  # Conteos en SQL: no necesita AgregadosKPI
+    else:
+        backend = BackendHojasFragmentadas(FRAGMENTACION_HOJA) if FRAGMENTACION_HOJA else BackendGoogleSheets()
+        backend.publicador.suscribir("agregados", lambda df, gen: get_agregados_kpi().sincronizar(df, gen))
+    backend.publicador.suscribir("duplicados", lambda df, gen: get_indice_duplicados().sincronizar(df, gen))
+    backend.publicador.suscribir("cubo", lambda df, gen: get_cubo().sincronizar(df, gen))
+    backend.publicador.iniciar()
+    return backend
+
+def get_data(forzar=False):
+    try: return get_backend().cargar(forzar)
+    except Exception as e:
+        METRICAS.error("get_data", e)
+        return pd.DataFrame()
+
+def get_snapshot(forzar=False):
+    try: return get_backend().snapshot(forzar)
+    except Exception as e:
+        METRICAS.error("get_snapshot", e)
+        return pd.DataFrame(), 0
+
+class ColaEscritura:
+    """Journal local (SQLite) con un hilo que lo vacía hacia el backend por lotes.
+
+    save_data solo inserta en el journal y retorna; el hilo toma lotes de hasta
+    LOTE_ESCRITURA filas, los envía con anexar_filas y los borra al confirmar.
+    Cada lote se reclama con un arriendo temporal para que varios procesos
+    sobre el mismo journal no envíen la misma fila dos veces.
+    """
+    ARRIENDO_SEG = 120
+
+    def __init__(self, ruta, obtener_backend):
+        self.ruta = ruta
+        self.obtener_backend = obtener_backend
+        self.evento = threading.Event()
+        self.fallos = 0
+        self.metricas = {"ultimo_flush": None, "latencia_flush_seg": None,
+                         "espera_max_seg": None, "filas_enviadas": 0, "ultimo_error": None}
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as con:
+            con.execute("""CREATE TABLE IF NOT EXISTS pendientes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fila TEXT NOT NULL,
+                creado REAL NOT NULL,
+                arriendo REAL NOT NULL DEFAULT 0)""")
+
+    def _conectar(self):
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def encolar(self, fila):
+        con = self._conectar()
+        try:
+            con.execute("INSERT INTO pendientes (fila, creado) VALUES (?, ?)",
+                        (json.dumps(fila, ensure_ascii=False), time.time()))
+        finally: con.close()
+        self.evento.set()
+
+    def encolar_lote(self, filas, en_transaccion=None):
+        """Encola varias filas en una transacción; en_transaccion(con) corre dentro
+        de la misma, para confirmar datos propios del llamador junto con las filas."""
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                ahora = time.time()
+                con.executemany("INSERT INTO pendientes (fila, creado) VALUES (?, ?)",
+                                [(json.dumps(f, ensure_ascii=False), ahora) for f in filas])
+                if en_transaccion: en_transaccion(con)
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        finally: con.close()
+        if filas: self.evento.set()
+
+    def profundidad(self):
+        con = self._conectar()
+        try: return con.execute("SELECT COUNT(*) FROM pendientes").fetchone()[0]
+        finally: con.close()
+
+    def _reclamar_lote(self, con):
+        ahora = time.time()
+        con.execute("BEGIN IMMEDIATE")
+        lote = con.execute("SELECT id, fila, creado FROM pendientes WHERE arriendo < ? ORDER BY id LIMIT ?",
+                           (ahora, LOTE_ESCRITURA)).fetchall()
+        if lote:
+            con.executemany("UPDATE pendientes SET arriendo = ? WHERE id = ?",
+                            [(ahora + self.ARRIENDO_SEG, r[0]) for r in lote])
+        con.execute("COMMIT")
+        return lote
+
+    def vaciar(self):
+        """Envía un lote; retorna cuántas filas se confirmaron."""
+        con = self._conectar()
+        try:
+            lote = self._reclamar_lote(con)
+            if not lote: return 0
+            ids = [r[0] for r in lote]
+            try:
+                backend = self.obtener_backend()
+                t0 = time.time()
+                with METRICAS.medir("write", "anexar_filas"): backend.anexar_filas([json.loads(r[1]) for r in lote])
+                fin = time.time()
+                METRICAS.contar("filas_escritas", len(lote))
+                backend.publicador.despertar.set()  # Releer ya en lugar de esperar el próximo ciclo
+            except Exception as e:
+                if isinstance(e, EscrituraParcial):  # Lo ya confirmado no se reenvía
+                    confirmados = [ids[i] for i in e.confirmadas]
+                    con.executemany("DELETE FROM pendientes WHERE id = ?", [(i,) for i in confirmados])
+                    METRICAS.contar("filas_escritas", len(confirmados))
+                    ids = sorted(set(ids) - set(confirmados))
+                con.executemany("UPDATE pendientes SET arriendo = 0 WHERE id = ?", [(i,) for i in ids])
+                self.metricas["ultimo_error"] = f"{type(e).__name__}: {e}"
+                raise
+            con.executemany("DELETE FROM pendientes WHERE id = ?", [(i,) for i in ids])
+            self.metricas.update({"ultimo_flush": fin, "latencia_flush_seg": fin - t0,
+                                  "espera_max_seg": fin - min(r[2] for r in lote),
+                                  "filas_enviadas": self.metricas["filas_enviadas"] + len(lote)})
+            return len(lote)
+        finally: con.close()
+
+    def _bucle(self):
+        while True:
+            try:
+                enviadas = self.vaciar()
+                self.fallos = 0
+                if enviadas == LOTE_ESCRITURA: continue  # Aún puede haber más en cola
+                self.evento.wait(timeout=5)
+                self.evento.clear()
+            except Exception as e:
+                METRICAS.error("cola_escritura", e)
+                self.fallos += 1
+                time.sleep(min(REINTENTO_BASE_SEG * 2 ** (self.fallos - 1), REINTENTO_MAX_SEG))
+
+    def iniciar(self):
+        threading.Thread(target=self._bucle, name="pulse-cola-escritura", daemon=True).start()
+        return self
+
+    def estado(self):
+        return {"profundidad": self.profundidad(), "fallos_consecutivos": self.fallos, **self.metricas}
+
+    def filas_pendientes(self):
+        con = self._conectar()
+        try: return [json.loads(r[0]) for r in con.execute("SELECT fila FROM pendientes ORDER BY id")]
+        finally: con.close()
+
+@st.cache_resource
+def get_cola_escritura():
+    return ColaEscritura(RUTA_JOURNAL, get_backend).iniciar()
 
 def save_data(data_dict):
-    client = get_google_sheet_client()
-    if not client: return False
+    """Registra la fila en el journal local; el envío a la hoja es asíncrono."""
     try:
-        sh = client.open("Base_Datos_Ciudadanos")
-        ts = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+        ts = pd.Timestamp.now().strftime(FORMATO_FECHA)
         user = st.session_state.get("user_name", "Anónimo")
         row = [
             ts, user, data_dict["nombre"], data_dict["cedula"], data_dict["telefono"],
             data_dict["ocupacion"], data_dict["direccion"], data_dict["barrio"], 
             data_dict["ciudad"], data_dict.get("puesto", "")
         ]
-        sh.sheet1.append_row(row)
+        with METRICAS.medir("write", "encolar"): get_cola_escritura().encolar(row)
         return True
-    except Exception: return False
+    except Exception as e:
+        METRICAS.error("save_data", e)
+        return False
+
+def _leer_geojson_pais():
+    """Lee el GeoJSON nacional incluido en el repositorio; solo lo descarga si falta."""
+    if os.path.exists(RUTA_GEOJSON_PAIS):
+        with open(RUTA_GEOJSON_PAIS, encoding="utf-8") as f: return json.load(f)
+    raw_url = URL_GITHUB_GEO.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
+    response = requests.get(raw_url, timeout=15)
+    response.raise_for_status()
+    return response.json()
+
+def _ruta_artefacto_geo(dpto):
+    return os.path.join(DIR_GEO, f"dpto_{dpto}.v{VERSION_GEO}.json")
+
+def _douglas_peucker(puntos, tolerancia):
+    """Douglas-Peucker iterativo; conserva siempre el primer y el último punto."""
+    n = len(puntos)
+    if n < 3 or tolerancia <= 0: return list(puntos)
+    pts = np.asarray(puntos, dtype=float)
+    conservar = np.zeros(n, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1: continue
+        a, d = pts[i], pts[j] - pts[i]
+        tramo = pts[i + 1:j] - a
+        largo = np.hypot(d[0], d[1])
+        if largo == 0: dist = np.hypot(tramo[:, 0], tramo[:, 1])
+        else: dist = np.abs(d[0] * tramo[:, 1] - d[1] * tramo[:, 0]) / largo
+        k = int(np.argmax(dist))
+        if dist[k] > tolerancia:
+            m = i + 1 + k
+            conservar[m] = True
+            pila += [(i, m), (m, j)]
+    return [puntos[i] for i in np.flatnonzero(conservar)]
+
+def _anillos(geometria):
+    return [geometria["coordinates"]] if geometria["type"] == "Polygon" else geometria["coordinates"]
+
+def simplificar_geojson(geojson, tolerancia, decimales=6):
+    """Simplifica respetando la topología: los bordes compartidos se simplifican una vez.
+
+    Un vértice es nodo si aparece con vecinos distintos en distintos anillos
+    (ahí se separan dos municipios). Cada tramo entre nodos se simplifica en
+    una orientación canónica y se reutiliza en ambos polígonos, de modo que
+    los vecinos siguen compartiendo exactamente el mismo borde, sin huecos.
+    """
+    vecinos = {}
+    for f in geojson["features"]:
+        for poligono in _anillos(f["geometry"]):
+            for anillo in poligono:
+                pts = [tuple(p) for p in anillo[:-1]]
+                for i, p in enumerate(pts):
+                    vecinos.setdefault(p, set()).add(frozenset((pts[i - 1], pts[(i + 1) % len(pts)])))
+    nodos = {p for p, v in vecinos.items() if len(v) > 1}
+    cache_tramos = {}
+
+    def simplificar_tramo(tramo):
+        invertido = tramo[0] > tramo[-1] or (tramo[0] == tramo[-1] and len(tramo) > 2 and tramo[1] > tramo[-2])
+        canonico = tuple(reversed(tramo)) if invertido else tuple(tramo)
+        if canonico not in cache_tramos:
+            cache_tramos[canonico] = _douglas_peucker(canonico, tolerancia)
+        res = cache_tramos[canonico]
+        return res[::-1] if invertido else res
+
+    def simplificar_anillo(anillo):
+        pts = [tuple(p) for p in anillo[:-1]]
+        cortes = [i for i, p in enumerate(pts) if p in nodos]
+        if not cortes:  # Anillo sin vecinos: se fija el punto más lejano al inicial
+            lejos = int(np.argmax(np.hypot(*(np.asarray(pts) - pts[0]).T)))
+            cortes = [0, lejos] if lejos else [0]
+        inicio = cortes[0]
+        pts = pts[inicio:] + pts[:inicio]
+        cortes = [c - inicio for c in cortes] + [len(pts)]
+        pts.append(pts[0])
+        salida = []
+        for a, b in zip(cortes, cortes[1:]):
+            salida.extend(simplificar_tramo(pts[a:b + 1])[:-1])
+        if len(salida) < 3: salida = pts[:-1]  # El anillo colapsaría: se deja intacto
+        salida.append(salida[0])
+        return [[round(x, decimales), round(y, decimales)] for x, y in salida]
+
+    features = []
+    for f in geojson["features"]:
+        geo = f["geometry"]
+        nuevos = [[simplificar_anillo(a) for a in pol] for pol in _anillos(geo)]
+        coords = nuevos[0] if geo["type"] == "Polygon" else nuevos
+        features.append({**f, "geometry": {"type": geo["type"], "coordinates": coords}})
+    return {"type": "FeatureCollection", "features": features}
+
+def _ruta_nivel_geo(dpto, nivel):
+    nombre, decimales = nivel
+    return os.path.join(DIR_GEO, f"dpto_{dpto}_{nombre}_{decimales}.v{VERSION_GEO}.json")
+
+def _centroide_poligono(poligono):
+    """Centroide ponderado por área (fórmula del polígono) descontando huecos; retorna (punto, área)."""
+    area_total, momento = 0.0, np.zeros(2)
+    for i, anillo in enumerate(poligono):
+        p = np.asarray(anillo, dtype=float)
+        x, y = p[:, 0], p[:, 1]
+        x1, y1 = np.roll(x, -1), np.roll(y, -1)
+        cruz = x * y1 - x1 * y
+        area = cruz.sum() / 2
+        if area == 0: continue
+        centro = np.array([((x + x1) * cruz).sum(), ((y + y1) * cruz).sum()]) / (6 * area)
+        peso = abs(area) if i == 0 else -abs(area)  # El anillo 0 es el exterior; los demás son huecos
+        area_total += peso
+        momento += peso * centro
+    if area_total <= 0:
+        return np.asarray(poligono[0], dtype=float).mean(axis=0), 0.0
+    return momento / area_total, area_total
+
+def _bordes(poligono):
+    """Segmentos (inicio, fin) de todos los anillos como dos arreglos (n, 2)."""
+    a = np.concatenate([np.asarray(r[:-1], dtype=float) for r in poligono])
+    b = np.concatenate([np.asarray(r[1:], dtype=float) for r in poligono])
+    return a, b
+
+def _dentro(puntos, a, b):
+    """Regla par-impar vectorizada: puntos (m, 2) contra los bordes del polígono."""
+    px, py = puntos[:, :1], puntos[:, 1:]
+    cruza = (a[:, 1] > py) != (b[:, 1] > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_corte = a[:, 0] + (py - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+    return ((cruza & (px < x_corte)).sum(axis=1) % 2) == 1
+
+def _distancia_borde(puntos, a, b):
+    """Distancia mínima de cada punto a los bordes del polígono."""
+    d = b - a
+    largo2 = np.maximum((d ** 2).sum(axis=1), 1e-18)
+    rel = puntos[:, None, :] - a[None, :, :]
+    t = np.clip((rel * d[None]).sum(axis=2) / largo2, 0, 1)
+    cerca = a[None] + t[..., None] * d[None]
+    return np.sqrt(((puntos[:, None, :] - cerca) ** 2).sum(axis=2)).min(axis=1)
 
-@st.cache_data(ttl=3600)
-def get_valle_geojson(url):
-    """Descarga el GeoJSON completo y filtra el Valle del Cauca en tiempo real."""
-    raw_url = url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
+def _polo_inaccesibilidad(poligono, pasos=24, refinamientos=3):
+    """Punto interior más alejado del borde, buscado en rejillas cada vez más finas."""
+    a, b = _bordes(poligono)
+    mins, maxs = a.min(axis=0), a.max(axis=0)
+    mejor, mejor_d = None, -1.0
+    centro, mitad = (mins + maxs) / 2, (maxs - mins) / 2
+    for _ in range(refinamientos):
+        gx, gy = np.meshgrid(np.linspace(centro[0] - mitad[0], centro[0] + mitad[0], pasos),
+                             np.linspace(centro[1] - mitad[1], centro[1] + mitad[1], pasos))
+        cand = np.column_stack([gx.ravel(), gy.ravel()])
+        cand = cand[_dentro(cand, a, b)]
+        if len(cand):
+            d = _distancia_borde(cand, a, b)
+            k = int(np.argmax(d))
+            if d[k] > mejor_d: mejor, mejor_d = cand[k], d[k]
+        if mejor is None: break
+        centro, mitad = mejor, mitad * 2 / pasos
+    return mejor
+
+def punto_etiqueta(geometria):
+    """Ancla de la etiqueta: centroide de la parte más grande, o su polo de
+    inaccesibilidad si el centroide cae fuera (municipios cóncavos)."""
+    mayor = max(_anillos(geometria), key=lambda pol: _centroide_poligono(pol)[1])
+    centro, _ = _centroide_poligono(mayor)
+    a, b = _bordes(mayor)
+    if not _dentro(centro[None], a, b)[0]:
+        polo = _polo_inaccesibilidad(mayor)
+        if polo is not None: centro = polo
+    return float(centro[0]), float(centro[1])
+
+_LOCK_ARTEFACTO_GEO = threading.Lock()
+
+@METRICAS.medido("geometry", "construir_artefacto")
+def construir_artefacto_geo(dpto=DPTO_VALLE):
+    """Extrae un departamento del GeoJSON nacional y lo guarda compacto en DIR_GEO.
+
+    Se ejecuta una sola vez (primer arranque o cuando cambia el archivo fuente);
+    las cargas posteriores leen solo el artefacto del departamento. Las sesiones
+    y el hilo publicador comparten proceso: el lock deja construir a uno solo y
+    los demás, al entrar, encuentran el artefacto ya vigente.
+    """
+    with _LOCK_ARTEFACTO_GEO:
+        ruta = _ruta_artefacto_geo(dpto)
+        if _artefacto_vigente(ruta): return ruta
+        return _construir_artefacto_geo(dpto, ruta)
+
+def _construir_artefacto_geo(dpto, ruta):
+    data = _leer_geojson_pais()
+    features = []
+    for feature in data["features"]:
+        props = feature["properties"]
+        if str(props.get("DPTO_CCDGO")) == dpto:
+            features.append({
+                "type": "Feature",
+                "id": str(props.get("MPIO_CCNCT", "")),
+                "properties": {k: props.get(k) for k in PROPIEDADES_GEO},
+                "geometry": feature["geometry"],
+            })
+    if not features: return None
+    for f in features:  # Anclas de etiqueta calculadas una vez sobre la geometría completa
+        f["properties"]["LABEL_LON"], f["properties"]["LABEL_LAT"] = punto_etiqueta(f["geometry"])
+    base = {"type": "FeatureCollection", "features": features}
+    os.makedirs(DIR_GEO, exist_ok=True)
+    for nombre, tolerancia in NIVELES_GEO.items():
+        for decimales in DECIMALES_GEO:
+            _escribir_json_atomico(_ruta_nivel_geo(dpto, (nombre, decimales)),
+                                   simplificar_geojson(base, tolerancia, decimales))
+    _escribir_json_atomico(ruta, base)  # El artefacto base se escribe al final: marca que los niveles están listos
+    return ruta
+
+def _escribir_json_atomico(ruta, data):
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"  # Único por escritor, aun dentro del proceso
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, ruta)  # Reemplazo atómico: otros procesos nunca leen un archivo a medias
+
+def _artefacto_vigente(ruta):
+    if not os.path.exists(ruta): return False
+    return not os.path.exists(RUTA_GEOJSON_PAIS) or os.path.getmtime(ruta) >= os.path.getmtime(RUTA_GEOJSON_PAIS)
+
+@st.cache_resource
+def _cargar_artefacto_geo(ruta, version):
+    """Una copia compartida por proceso; la clave version invalida al regenerar."""
+    METRICAS.tamano(f"geojson_{os.path.basename(ruta)}", os.path.getsize(ruta))
+    with METRICAS.medir("geometry", "cargar_artefacto"), open(ruta, encoding="utf-8") as f: return json.load(f)
+
+def get_geojson_dpto(dpto=DPTO_VALLE, nivel=None):
+    """GeoJSON de un departamento (DPTO_CCDGO) en el nivel (nombre, decimales) pedido.
+
+    Sin nivel se entrega el artefacto base, con la geometría original."""
+    ruta = _ruta_artefacto_geo(dpto)
     try:
-        response = requests.get(raw_url, timeout=15)
-        if response.status_code == 200:
-            data = response.json()
-            valle_features = []
-            for feature in data["features"]:
-                props = feature["properties"]
-                if str(props.get("DPTO_CCDGO")) == "76":
-                    m_name = normalizar(props.get("MPIO_CNMBR", ""))
-                    feature["id"] = m_name
-                    valle_features.append(feature)
-            
-            if valle_features:
-                return {"type": "FeatureCollection", "features": valle_features}
+        if not _artefacto_vigente(ruta) and not construir_artefacto_geo(dpto): return None
+        ruta_nivel = _ruta_nivel_geo(dpto, nivel) if nivel else ruta
+        if not os.path.exists(ruta_nivel): ruta_nivel = ruta
+        return _cargar_artefacto_geo(ruta_nivel, os.path.getmtime(ruta))
     except Exception as e:
+        METRICAS.error("geojson", e)
         st.error(f"Error cargando GeoJSON: {e}")
     return None
 
-# --- 5. LÓGICA DE AUTENTICACIÓN ---
+@st.cache_resource
+def _extension_geo(dpto, version):
+    """Mayor lado (en grados) del rectángulo que contiene al departamento."""
+    geo = get_geojson_dpto(dpto)
+    pts = np.array([p for f in geo["features"] for pol in _anillos(f["geometry"]) for a in pol for p in a])
+    return float(max(np.ptp(pts[:, 0]), np.ptp(pts[:, 1])))
+
+def elegir_nivel_geo(alto_px, dpto=DPTO_VALLE):
+    """(nombre, decimales) más liviano cuyo error no supera PIXELES_TOLERANCIA.
+
+    Tolerancia y precisión se eligen por separado: el redondeo a d decimales
+    mueve cada vértice a lo sumo medio 10^-d grados, aunque la simplificación
+    no quite ninguno."""
+    ruta = _ruta_artefacto_geo(dpto)
+    if not _artefacto_vigente(ruta) and not construir_artefacto_geo(dpto): return "completo", max(DECIMALES_GEO)
+    limite = _extension_geo(dpto, os.path.getmtime(ruta)) / max(alto_px, 1) * PIXELES_TOLERANCIA
+    aptos = [(tol, n) for n, tol in NIVELES_GEO.items() if tol <= limite]
+    nombre = max(aptos)[1] if aptos else "completo"
+    return nombre, min((d for d in DECIMALES_GEO if 0.5 * 10 ** -d <= limite), default=max(DECIMALES_GEO))
+
+@st.cache_resource
+def _etiquetas_geo(dpto, version):
+    geo = get_geojson_dpto(dpto)
+    return pd.DataFrame({
+        "MPIO_CCNCT": [f["id"] for f in geo["features"]],
+        "ID_MPIO": [normalizar(f["properties"]["MPIO_CNMBR"]) for f in geo["features"]],
+        "lon": [f["properties"]["LABEL_LON"] for f in geo["features"]],
+        "lat": [f["properties"]["LABEL_LAT"] for f in geo["features"]],
+    })
+
+def get_etiquetas_geo(dpto=DPTO_VALLE):
+    """Anclas precalculadas de las etiquetas municipales (MPIO_CCNCT, ID_MPIO, lon, lat)."""
+    ruta = _ruta_artefacto_geo(dpto)
+    if not _artefacto_vigente(ruta) and not construir_artefacto_geo(dpto): return None
+    return _etiquetas_geo(dpto, os.path.getmtime(ruta))
+
+def _trigramas(texto):
+    t = f"  {texto} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+def _distancia_edicion(a, b):
+    """Levenshtein con dos filas; los nombres de municipio son cortos."""
+    if len(a) < len(b): a, b = b, a
+    previa = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(previa[j] + 1, actual[j - 1] + 1, previa[j - 1] + (ca != cb)))
+        previa = actual
+    return previa[-1]
+
+class ResolvedorMunicipios:
+    """Texto libre de 'Ciudad' -> código DANE (MPIO_CCNCT).
+
+    Primero busca coincidencia exacta entre nombres oficiales y alias ya
+    normalizados; si no la hay, un índice de trigramas propone candidatos que
+    se ordenan por distancia de edición. Los resultados quedan memorizados.
+    """
+    SUFIJOS = re.compile(r"(\s+(V|VALLE|VALLE DEL CAUCA|DEL VALLE))+$")
+    CANDIDATOS = 8
+    SIMILITUD_MINIMA = 0.75
+
+    def __init__(self, nombres, alias=None):
+        self.nombres = dict(nombres)  # código -> nombre oficial normalizado
+        self.claves = {n: c for c, n in self.nombres.items()}
+        for a, destino in (alias or {}).items():
+            codigo = self.claves.get(normalizar(destino))
+            if codigo: self.claves.setdefault(normalizar(a), codigo)
+        self.indice = {}
+        for clave in self.claves:
+            for tri in _trigramas(clave):
+                self.indice.setdefault(tri, []).append(clave)
+        self.resolver = lru_cache(maxsize=TAMANO_CACHE_NORMALIZACION)(self._resolver)
+
+    def limpiar(self, texto):
+        t = re.sub(r"[^A-Z0-9 ]", " ", normalizar(texto))
+        return self.SUFIJOS.sub("", " ".join(t.split()))
+
+    def _resolver(self, texto):
+        t = self.limpiar(texto)
+        if not t: return None
+        if t in self.claves: return self.claves[t]
+        votos = {}
+        for tri in _trigramas(t):
+            for clave in self.indice.get(tri, ()):
+                votos[clave] = votos.get(clave, 0) + 1
+        mejores = sorted(votos, key=votos.get, reverse=True)[:self.CANDIDATOS]
+        ranking = sorted((_distancia_edicion(t, c), c) for c in mejores)
+        if not ranking: return None
+        dist, clave = ranking[0]
+        return self.claves[clave] if 1 - dist / max(len(t), len(clave)) >= self.SIMILITUD_MINIMA else None
+
+    def resolver_serie(self, serie):
+        return normalizar_serie(serie, lambda v: self.resolver(v) or "").replace("", None)
+
+@st.cache_resource
+def _resolvedor(dpto, version):
+    etiquetas = get_etiquetas_geo(dpto)
+    return ResolvedorMunicipios(zip(etiquetas["MPIO_CCNCT"], etiquetas["ID_MPIO"]), MAPEO_MUNICIPIOS)
+
+def get_resolvedor(dpto=DPTO_VALLE):
+    """Resolvedor de municipios del departamento, reconstruido si cambia la geometría."""
+    ruta = _ruta_artefacto_geo(dpto)
+    if not _artefacto_vigente(ruta) and not construir_artefacto_geo(dpto): return None
+    return _resolvedor(dpto, os.path.getmtime(ruta))
+
+@METRICAS.medido("aggregate", "municipios")
+def conteo_por_municipio(por_ciudad, resolvedor):
+    """Agrupa conteos por texto de ciudad en conteos por código DANE.
+
+    Lo que no se pudo resolver conserva su texto normalizado como nombre y
+    MPIO_CCNCT nulo, para que siga visible en el ranking aunque no en el mapa.
+    """
+    codigos = resolvedor.resolver_serie(por_ciudad['Ciudad'])
+    nombres = codigos.map(resolvedor.nombres).fillna(normalizar_serie(por_ciudad['Ciudad']))
+    out = (por_ciudad.assign(MPIO_CCNCT=codigos, ID_MPIO=nombres)
+           .groupby(['MPIO_CCNCT', 'ID_MPIO'], dropna=False)['Registros'].sum()
+           .sort_values(ascending=False).reset_index())
+    return out
+
+def _celda_texto(valor):
+    """Celda de Excel como texto; los números enteros no arrastran '.0'."""
+    if valor is None: return ""
+    if isinstance(valor, float) and valor.is_integer(): return str(int(valor))
+    if isinstance(valor, datetime): return valor.strftime(FORMATO_FECHA)
+    return str(valor)
+
+def leer_por_bloques(archivo, nombre, tamano=LOTE_IMPORTACION):
+    """Genera DataFrames de texto de a `tamano` filas desde un CSV o XLSX.
+
+    El CSV se lee con chunksize (separador y codificación detectados en el
+    primer bloque de bytes); el XLSX con openpyxl en modo read_only, que
+    recorre las filas sin cargar el libro completo en memoria. El índice de
+    cada bloque es el número de fila en el archivo (encabezado = 1); las filas
+    vacías se descartan después de numerar, así que no corren la numeración.
+    """
+    if nombre.lower().endswith((".xlsx", ".xlsm")):
+        if openpyxl is None: raise RuntimeError("Instale openpyxl para importar archivos Excel")
+        libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+        try:
+            # Desde la fila 1: read_only completa con tuplas vacías las filas ausentes
+            filas = libro.worksheets[0].iter_rows(min_row=1, values_only=True)
+            encabezados = [_celda_texto(c).strip() for c in next(filas, ())]
+            ancho, bloque, numeros = len(encabezados), [], []
+            for numero, fila in enumerate(filas, start=2):
+                if not any(c not in (None, "") for c in fila): continue  # Filas vacías del formato
+                bloque.append([_celda_texto(c) for c in fila[:ancho]] + [""] * (ancho - len(fila)))
+                numeros.append(numero)
+                if len(bloque) == tamano:
+                    yield pd.DataFrame(bloque, columns=encabezados, index=numeros)
+                    bloque, numeros = [], []
+            if bloque: yield pd.DataFrame(bloque, columns=encabezados, index=numeros)
+        finally: libro.close()
+        return
+    muestra = archivo.read(65536)
+    archivo.seek(0)
+    try:
+        texto, codificacion = muestra.decode("utf-8-sig"), "utf-8-sig"
+    except UnicodeDecodeError:  # Exportaciones de Excel en Windows
+        texto, codificacion = muestra.decode("latin-1"), "latin-1"
+    try: separador = csv.Sniffer().sniff(texto.split("\n", 1)[0], delimiters=",;\t|").delimiter
+    except csv.Error: separador = ","
+    pendiente = None
+    # El with cierra el lector sin cerrar `archivo` si la importación se corta a medias
+    with pd.read_csv(archivo, sep=separador, encoding=codificacion, dtype=str, keep_default_na=False,
+                     skip_blank_lines=False, chunksize=tamano) as lector:
+        for bloque in lector:
+            bloque.index = bloque.index + 2  # Posición entre los datos -> línea del archivo
+            bloque = bloque[(bloque.fillna("") != "").any(axis=1)]
+            # Sin las vacías un bloque queda corto; se completan a `tamano` para no
+            # cambiar los límites de bloque con que se retoma una importación
+            pendiente = bloque if pendiente is None else pd.concat([pendiente, bloque])
+            while len(pendiente) >= tamano:
+                yield pendiente.iloc[:tamano]
+                pendiente = pendiente.iloc[tamano:]
+    if pendiente is not None and len(pendiente): yield pendiente
+
+class ImportadorMasivo:
+    """Carga masiva de registros desde CSV/XLSX hacia el journal de escritura.
+
+    Cada bloque se valida en forma vectorizada (mayúsculas como view_registro,
+    obligatorios, municipio resuelto a su nombre oficial, cédulas repetidas en
+    la base, en el journal o en el mismo archivo) y se confirma en una única
+    transacción del journal junto con su progreso y sus errores. Si el proceso
+    se interrumpe, volver a subir el mismo archivo (identificado por su hash)
+    continúa después del último bloque confirmado. El envío a la hoja lo hace
+    la ColaEscritura en lotes de LOTE_ESCRITURA filas.
+    """
+    CAMPOS = ["nombre", "cedula", "telefono", "ocupacion", "direccion", "barrio", "ciudad", "puesto", "registrado_por"]
+    MAYUSCULAS = ["nombre", "ocupacion", "direccion", "barrio", "ciudad", "puesto"]
+
+    def __init__(self, cola, obtener_resolvedor, obtener_duplicados, tamano_bloque=LOTE_IMPORTACION):
+        self.cola = cola
+        self.tamano_bloque = tamano_bloque
+        self.obtener_resolvedor = obtener_resolvedor
+        self.obtener_duplicados = obtener_duplicados
+        con = cola._conectar()
+        try:
+            con.execute("""CREATE TABLE IF NOT EXISTS importaciones (
+                id TEXT PRIMARY KEY, archivo TEXT NOT NULL, usuario TEXT NOT NULL,
+                procesadas INTEGER NOT NULL DEFAULT 0, aceptadas INTEGER NOT NULL DEFAULT 0,
+                rechazadas INTEGER NOT NULL DEFAULT 0, completa INTEGER NOT NULL DEFAULT 0,
+                creada REAL NOT NULL, actualizada REAL NOT NULL)""")
+            con.execute("""CREATE TABLE IF NOT EXISTS errores_importacion (
+                importacion TEXT NOT NULL, fila INTEGER NOT NULL, motivo TEXT NOT NULL, datos TEXT NOT NULL)""")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_errores_importacion ON errores_importacion (importacion, fila)")
+        finally: con.close()
+
+    @staticmethod
+    def huella_archivo(archivo):
+        h = hashlib.blake2b(digest_size=16)
+        archivo.seek(0)
+        for trozo in iter(lambda: archivo.read(1 << 20), b""): h.update(trozo)
+        archivo.seek(0)
+        return h.hexdigest()
+
+    def estado(self, id_importacion):
+        con = self.cola._conectar()
+        try:
+            fila = con.execute("SELECT archivo, usuario, procesadas, aceptadas, rechazadas, completa "
+                               "FROM importaciones WHERE id = ?", (id_importacion,)).fetchone()
+        finally: con.close()
+        if not fila: return None
+        return dict(zip(["archivo", "usuario", "procesadas", "aceptadas", "rechazadas", "completa"], fila))
+
+    def errores(self, id_importacion):
+        con = self.cola._conectar()
+        try:
+            filas = con.execute("SELECT fila, motivo, datos FROM errores_importacion WHERE importacion = ? ORDER BY fila",
+                                (id_importacion,)).fetchall()
+        finally: con.close()
+        return pd.DataFrame([{"Fila": f, "Motivo": m, **json.loads(d)} for f, m, d in filas])
+
+    def validar(self, bloque, usuario):
+        """Retorna (filas listas para el journal, DataFrame de rechazos con Fila y Motivo).
+
+        Fila sale del índice de bloque: el número de fila en el archivo (ver leer_por_bloques)."""
+        bloque = bloque.rename(columns=lambda c: ALIAS_IMPORTACION.get(normalizar(c), c))
+        bloque = bloque.loc[:, ~bloque.columns.duplicated()]
+        d = pd.DataFrame(index=bloque.index)
+        for campo in self.CAMPOS:
+            d[campo] = bloque[campo].astype("string").fillna("").str.strip() if campo in bloque.columns else ""
+        for campo in self.MAYUSCULAS: d[campo] = d[campo].str.upper()
+        d["cedula"], d["telefono"] = _solo_digitos(d["cedula"]), _solo_digitos(d["telefono"])
+        d["registrado_por"] = d["registrado_por"].mask(d["registrado_por"] == "", usuario)
+
+        motivo = pd.Series("", index=d.index, dtype="string")
+        for campo, etiqueta in (("nombre", "nombre"), ("cedula", "cédula"), ("telefono", "teléfono"), ("ciudad", "municipio")):
+            motivo = motivo.mask((d[campo] == "") & (motivo == ""), f"Falta {etiqueta}")
+        resolvedor = self.obtener_resolvedor()
+        if resolvedor:
+            codigos = resolvedor.resolver_serie(d["ciudad"])
+            motivo = motivo.mask(codigos.isna() & (motivo == ""), "Municipio no reconocido")
+            d["ciudad"] = codigos.map(resolvedor.nombres).fillna(d["ciudad"])
+
+        candidatas = (motivo == "").to_numpy()
+        reservada, existia, _ = self.obtener_duplicados().reservar_lote(d["cedula"][candidatas], d["telefono"][candidatas])
+        idx = d.index[candidatas]
+        motivo.loc[idx[existia]] = "Cédula ya registrada"
+        motivo.loc[idx[~existia & ~reservada]] = "Cédula repetida en el archivo"
+
+        rechazada = (motivo != "").to_numpy()
+        ts = pd.Timestamp.now().strftime(FORMATO_FECHA)
+        filas = [[ts, r.registrado_por, r.nombre, r.cedula, r.telefono, r.ocupacion,
+                  r.direccion, r.barrio, r.ciudad, r.puesto] for r in d[~rechazada].itertuples(index=False)]
+        rechazos = bloque[rechazada].assign(Fila=bloque.index[rechazada],
+                                            Motivo=motivo[rechazada].to_numpy())
+        return filas, rechazos
+
+    def importar(self, archivo, nombre, usuario, al_avanzar=None):
+        """Procesa el archivo completo (o lo que falte de él); retorna (id, estado)."""
+        id_importacion = self.huella_archivo(archivo)
+        previo = self.estado(id_importacion)
+        if previo and previo["completa"]: return id_importacion, previo
+        if not previo:
+            con = self.cola._conectar()
+            try:
+                con.execute("INSERT INTO importaciones (id, archivo, usuario, creada, actualizada) VALUES (?, ?, ?, ?, ?)",
+                            (id_importacion, nombre, usuario, time.time(), time.time()))
+            finally: con.close()
+        estado = self.estado(id_importacion)
+        procesadas = 0
+        for bloque in leer_por_bloques(archivo, nombre, self.tamano_bloque):
+            if procesadas + len(bloque) <= estado["procesadas"]:  # Confirmado en un intento anterior
+                procesadas += len(bloque)
+                continue
+            omitir = estado["procesadas"] - procesadas if estado["procesadas"] > procesadas else 0
+            bloque = bloque.iloc[omitir:]
+            procesadas += omitir
+            with METRICAS.medir("write", "importacion_bloque"):
+                filas, rechazos = self.validar(bloque, usuario)
+                procesadas += len(bloque)
+                estado["procesadas"] = procesadas
+                estado["aceptadas"] += len(filas)
+                estado["rechazadas"] += len(rechazos)
+
+                def confirmar(con, rechazos=rechazos, estado=dict(estado)):
+                    con.executemany("INSERT INTO errores_importacion (importacion, fila, motivo, datos) VALUES (?, ?, ?, ?)",
+                                    [(id_importacion, int(r["Fila"]), r["Motivo"],
+                                      json.dumps({k: v for k, v in r.items() if k not in ("Fila", "Motivo")},
+                                                 ensure_ascii=False, default=str))
+                                     for r in rechazos.to_dict("records")])
+                    con.execute("UPDATE importaciones SET procesadas = ?, aceptadas = ?, rechazadas = ?, actualizada = ? "
+                                "WHERE id = ?", (estado["procesadas"], estado["aceptadas"], estado["rechazadas"],
+                                                 time.time(), id_importacion))
+                try: self.cola.encolar_lote(filas, confirmar)
+                except Exception:
+                    self.obtener_duplicados().liberar_lote([f[3] for f in filas])
+                    raise
+            METRICAS.contar("filas_importadas", len(filas))
+            if al_avanzar: al_avanzar(estado)
+        con = self.cola._conectar()
+        try: con.execute("UPDATE importaciones SET completa = 1, actualizada = ? WHERE id = ?", (time.time(), id_importacion))
+        finally: con.close()
+        estado["completa"] = 1
+        return id_importacion, estado
+
+@st.cache_resource
+def get_importador():
+    return ImportadorMasivo(get_cola_escritura(), get_resolvedor, get_indice_duplicados)
+
+def filtrar_registros(df, posiciones=None, codigo=None, lider=None, desde=None, hasta=None, resolvedor=None):
+    """Posiciones de df (en el orden de `posiciones`, o todas) que cumplen los filtros.
+
+    codigo es el MPIO_CCNCT del municipio: Ciudad se resuelve igual que en el
+    mapa. desde/hasta acotan Fecha Registro en [desde, hasta).
+    """
+    mascara = np.ones(len(df), dtype=bool)
+    if lider: mascara &= (df["Registrado Por"] == lider).to_numpy(dtype=bool, na_value=False)
+    if codigo and resolvedor:
+        mascara &= (resolvedor.resolver_serie(df["Ciudad"]) == codigo).to_numpy(dtype=bool, na_value=False)
+    if desde is not None: mascara &= (df["Fecha Registro"] >= desde).to_numpy(dtype=bool, na_value=False)
+    if hasta is not None: mascara &= (df["Fecha Registro"] < hasta).to_numpy(dtype=bool, na_value=False)
+    if posiciones is None: return np.flatnonzero(mascara)
+    return posiciones[mascara[posiciones]]
+
+def bloques_exportacion(df, posiciones, columnas, tamano=LOTE_EXPORTACION):
+    """Genera las filas seleccionadas en tramos de `tamano` (al menos uno, aunque esté vacío)."""
+    indices = [df.columns.get_loc(c) for c in columnas]
+    for inicio in range(0, max(len(posiciones), 1), tamano):
+        yield df.iloc[posiciones[inicio:inicio + tamano], indices]
+
+def escribir_exportacion(bloques, formato, ruta, al_avanzar=None):
+    """Escribe los tramos en `ruta` a medida que llegan; nunca junta el archivo en memoria.
+
+    Excel usa el modo write_only de openpyxl (las filas pasan a un temporal) y
+    Parquet un ParquetWriter con un grupo de filas por tramo."""
+    escritas, escritor, libro = 0, None, None
+    try:
+        for i, bloque in enumerate(bloques):
+            if formato == "csv":
+                if escritor is None: escritor = open(ruta, "w", encoding="utf-8-sig", newline="")
+                bloque.to_csv(escritor, index=False, header=i == 0, date_format=FORMATO_FECHA)
+            elif formato == "xlsx":
+                if libro is None:
+                    libro = openpyxl.Workbook(write_only=True)
+                    escritor = libro.create_sheet("Registros")
+                    escritor.append(list(bloque.columns))
+                for fila in bloque.astype(object).where(bloque.notna(), None).itertuples(index=False, name=None):
+                    escritor.append(fila)
+            elif formato == "parquet":
+                tabla = pa.Table.from_pandas(bloque, preserve_index=False,
+                                             schema=escritor.schema if escritor else None)
+                if escritor is None: escritor = pq.ParquetWriter(ruta, tabla.schema)
+                escritor.write_table(tabla)
+            else: raise ValueError(f"Formato no soportado: {formato}")
+            escritas += len(bloque)
+            if al_avanzar: al_avanzar(escritas)
+        if libro is not None: libro.save(ruta)
+    finally:
+        if escritor is not None and libro is None: escritor.close()
+    return escritas
+
+class ExportadorRegistros:
+    """Exportaciones en segundo plano, compartidas por el proceso.
+
+    Cada trabajo escribe su archivo por bloques en un hilo propio (a lo sumo
+    EXPORTACIONES_SIMULTANEAS a la vez), así ni la sesión que lo pidió ni las
+    demás esperan. Recibe el snapshot publicado, que no se modifica, así que no
+    necesita copiarlo. Los archivos se borran pasada VIGENCIA_EXPORTACION_SEG.
+    """
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.lock = threading.Lock()
+        self.turnos = threading.Semaphore(EXPORTACIONES_SIMULTANEAS)
+        self.trabajos = {}  # id -> estado
+
+    def iniciar(self, df, posiciones, columnas, formato, nombre):
+        """Encola la exportación y retorna el id del trabajo."""
+        self._limpiar()
+        os.makedirs(self.directorio, exist_ok=True)
+        id_trabajo = os.urandom(8).hex()
+        estado = {"ruta": os.path.join(self.directorio, f"{id_trabajo}.{formato}"), "archivo": f"{nombre}.{formato}",
+                  "formato": formato, "total": len(posiciones), "escritas": 0, "terminado": False,
+                  "error": None, "creado": time.time()}
+        with self.lock: self.trabajos[id_trabajo] = estado
+        threading.Thread(target=self._ejecutar, args=(estado, df, posiciones, columnas),
+                         name="pulse-exportacion", daemon=True).start()
+        return id_trabajo
+
+    def _ejecutar(self, estado, df, posiciones, columnas):
+        try:
+            with self.turnos, METRICAS.medir("write", f"exportacion_{estado['formato']}"):
+                escribir_exportacion(bloques_exportacion(df, posiciones, columnas), estado["formato"],
+                                     estado["ruta"], lambda n: estado.update(escritas=n))
+            METRICAS.tamano(f"exportacion_{estado['formato']}", os.path.getsize(estado["ruta"]))
+        except Exception as e:
+            METRICAS.error("exportacion", e)
+            estado["error"] = f"{type(e).__name__}: {e}"
+        finally: estado["terminado"] = True
+
+    def estado(self, id_trabajo):
+        with self.lock:
+            estado = self.trabajos.get(id_trabajo)
+            return dict(estado) if estado else None
+
+    def descartar(self, id_trabajo):
+        """Olvida un trabajo terminado y borra su archivo."""
+        with self.lock:
+            estado = self.trabajos.get(id_trabajo)
+            if not estado or not estado["terminado"]: return
+            del self.trabajos[id_trabajo]
+        try:
+            if os.path.exists(estado["ruta"]): os.remove(estado["ruta"])
+        except OSError as e: METRICAS.error("exportacion_limpiar", e)
+
+    def _limpiar(self):
+        limite = time.time() - VIGENCIA_EXPORTACION_SEG
+        with self.lock:
+            for id_trabajo, estado in list(self.trabajos.items()):
+                if estado["terminado"] and estado["creado"] < limite: del self.trabajos[id_trabajo]
+        if not os.path.isdir(self.directorio): return
+        for archivo in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, archivo)
+            try:
+                if os.path.getmtime(ruta) < limite: os.remove(ruta)
+            except OSError as e: METRICAS.error("exportacion_limpiar", e)
+
+@st.cache_resource
+def get_exportador():
+    return ExportadorRegistros(DIR_EXPORTACIONES)
+
+def formatos_exportacion():
+    """Formatos disponibles según las dependencias instaladas."""
+    return [f for f, (ext, _) in FORMATOS_EXPORTACION.items()
+            if not (ext == "xlsx" and openpyxl is None) and not (ext == "parquet" and pq is None)]
+
+# --- 6. ÍNDICES Y AGREGADOS EN MEMORIA ---
+def _trigramas_internos(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceBusqueda:
+    """Índice de trigramas para el explorador, sin tildes y en mayúsculas.
+
+    Cada campo se guarda como diccionario (valor normalizado -> id) más un
+    arreglo de códigos por fila, y los trigramas apuntan a ids de valor: un
+    barrio o municipio repetido miles de veces se indexa una sola vez. Mientras
+    la generación del snapshot no cambie, solo se indexan las filas nuevas.
+    """
+    def __init__(self, campos=CAMPOS_BUSQUEDA):
+        self.campos = campos
+        self.lock = threading.Lock()
+        self._reiniciar(None)
+
+    def _reiniciar(self, generacion):
+        self.generacion = generacion
+        self.filas = 0
+        self.valores = {c: [] for c in self.campos}          # id -> valor normalizado
+        self.ids = {c: {} for c in self.campos}              # valor -> id
+        self.codigos = {c: array("i") for c in self.campos}  # fila -> id
+        self.trigramas = {c: {} for c in self.campos}        # trigrama -> [ids]
+        self.tokens = {c: None for c in self.campos}         # Índice de prefijos, perezoso
+
+    @METRICAS.medido("aggregate", "indice_busqueda")
+    def sincronizar(self, df, generacion):
+        with self.lock:
+            # Con menos filas en la misma generación es una copia atrasada: no se retrocede
+            if generacion != self.generacion: self._reiniciar(generacion)
+            if len(df) > self.filas:
+                self._indexar(df.iloc[self.filas:])
+                self.filas = len(df)
+
+    def _indexar(self, nuevas):
+        for campo in self.campos:
+            if campo not in nuevas.columns:
+                self.codigos[campo].frombytes(np.full(len(nuevas), -1, dtype=np.int32).tobytes())
+                continue
+            codigos, unicos = pd.factorize(normalizar_serie(nuevas[campo]))
+            ids, valores, trigramas = self.ids[campo], self.valores[campo], self.trigramas[campo]
+            globales = np.empty(len(unicos), dtype=np.int32)
+            nuevos = []
+            for k, valor in enumerate(unicos):
+                if valor not in ids:
+                    ids[valor] = len(valores)
+                    valores.append(valor)
+                    nuevos.append(ids[valor])
+                    for tri in _trigramas_internos(valor):
+                        trigramas.setdefault(tri, []).append(ids[valor])
+                globales[k] = ids[valor]
+            self.codigos[campo].frombytes(globales[codigos].tobytes())
+            self._actualizar_tokens(campo, nuevos)
+
+    def _actualizar_tokens(self, campo, nuevos):
+        """Pocos valores nuevos se insertan en orden; muchos invalidan el índice de prefijos."""
+        if self.tokens[campo] is None or not nuevos: return
+        if len(nuevos) > 500:
+            self.tokens[campo] = None
+            return
+        tokens, ids = self.tokens[campo]
+        for i in nuevos:
+            for tok in set(self.valores[campo][i].split()):
+                pos = bisect.bisect_right(tokens, tok)
+                tokens.insert(pos, tok)
+                ids.insert(pos, i)
+
+    def _valores_que_coinciden(self, campo, q, modo):
+        valores = self.valores[campo]
+        if modo == "prefijo":
+            if self.tokens[campo] is None:
+                pares = sorted((tok, i) for i, v in enumerate(valores) for tok in set(v.split()))
+                self.tokens[campo] = ([t for t, _ in pares], [i for _, i in pares])
+            tokens, ids = self.tokens[campo]
+            primera = q.split()[0] if " " in q else q
+            inicio = bisect.bisect_left(tokens, primera)
+            fin = bisect.bisect_left(tokens, primera + "\uffff")
+            coincidencias = set(ids[inicio:fin])
+            if " " in q:  # Varias palabras: deben aparecer seguidas desde el inicio de cualquier palabra
+                coincidencias = {i for i in coincidencias if (" " + valores[i]).find(" " + q) >= 0}
+            return coincidencias
+        if len(q) < 3:  # Sin trigramas posibles: se recorren los valores distintos
+            return {i for i, v in enumerate(valores) if q in v}
+        # La lista de trigramas más corta ya acota los candidatos; se verifican directo
+        candidatos = min((self.trigramas[campo].get(t, ()) for t in _trigramas_internos(q)), key=len)
+        return {i for i in candidatos if q in valores[i]}
+
+    @METRICAS.medido("aggregate", "consulta_busqueda")
+    def buscar(self, consulta, modo="contiene"):
+        """Posiciones de fila (ordenadas) con coincidencia en algún campo."""
+        q = normalizar(consulta)
+        if not q: return np.array([], dtype=np.int64)
+        with self.lock:
+            partes = []
+            for campo in self.campos:
+                ids = self._valores_que_coinciden(campo, q, modo)
+                if ids:
+                    codigos = np.frombuffer(self.codigos[campo], dtype=np.int32)
+                    partes.append(np.flatnonzero(np.isin(codigos, np.fromiter(ids, dtype=np.int32))))
+            return np.unique(np.concatenate(partes)) if partes else np.array([], dtype=np.int64)
+
+@st.cache_resource
+def get_indice_busqueda():
+    return IndiceBusqueda()
+
+@METRICAS.medido("aggregate", "ordenar_resultados")
+def ordenar_posiciones(df, posiciones, columna=None, descendente=False):
+    """Reordena posiciones de fila por una columna leyendo solo esa columna."""
+    if columna is None or columna not in df.columns or len(posiciones) < 2: return posiciones
+    valores = df[columna].iloc[posiciones].reset_index(drop=True)
+    if isinstance(valores.dtype, pd.CategoricalDtype):  # Tras anexar, las categorías no quedan en orden alfabético
+        valores = valores.cat.reorder_categories(sorted(valores.cat.categories, key=str))
+    orden = valores.sort_values(ascending=not descendente, kind="stable", na_position="last").index.to_numpy()
+    return np.asarray(posiciones)[orden]
+
+def pagina_resultados(df, posiciones, columnas, pagina, tamano):
+    """Proyección de una sola página: primero se recortan filas y luego columnas."""
+    inicio = (pagina - 1) * tamano
+    return df.iloc[posiciones[inicio:inicio + tamano]][columnas]
+
+def _inicio_cubeta(fechas, frecuencia):
+    """Inicio de la cubeta (hora, día o semana desde el lunes) de un Timestamp o una serie."""
+    es_serie = isinstance(fechas, pd.Series)
+    if frecuencia == "h": return fechas.dt.floor("h") if es_serie else fechas.floor("h")
+    dia = fechas.dt.normalize() if es_serie else fechas.normalize()
+    if frecuencia == "D": return dia
+    return dia - pd.to_timedelta(dia.dt.dayofweek if es_serie else dia.dayofweek, unit="D")
+
+def completar_serie(conteos, frecuencia, desde=None, hasta=None):
+    """{inicio de cubeta: n} -> DataFrame ['F_S', 'Ingresos'] continuo (cubetas vacías en 0)
+    entre la primera y la última con datos dentro de [desde, hasta)."""
+    serie = pd.Series(list(conteos.values()), index=pd.to_datetime(list(conteos.keys())), dtype="int64").sort_index()
+    if desde is not None: serie = serie[serie.index >= _inicio_cubeta(pd.Timestamp(desde), frecuencia)]
+    if hasta is not None: serie = serie[serie.index < pd.Timestamp(hasta)]
+    if serie.empty: return pd.DataFrame({"F_S": pd.Series(dtype="datetime64[ns]"), "Ingresos": pd.Series(dtype="int64")})
+    indice = pd.date_range(serie.index[0], serie.index[-1], freq="W-MON" if frecuencia == "W" else frecuencia)
+    serie = serie.reindex(indice, fill_value=0)
+    return pd.DataFrame({"F_S": serie.index, "Ingresos": serie.to_numpy()})
+
+def elegir_frecuencia(desde, hasta):
+    """La granularidad más fina cuyo rango máximo cubre [desde, hasta)."""
+    dias = (pd.Timestamp(hasta) - pd.Timestamp(desde)) / pd.Timedelta(days=1)
+    for frecuencia, maximo in GRANULARIDADES_TENDENCIA:
+        if maximo is None or dias <= maximo: return frecuencia
+    return GRANULARIDADES_TENDENCIA[-1][0]
+
+def lttb(x, y, puntos):
+    """Índices elegidos por Largest-Triangle-Three-Buckets.
+
+    Conserva el primer y el último punto; el resto se reparte en puntos-2
+    cubetas y de cada una queda el punto que forma el triángulo de mayor área
+    con el elegido anterior y el promedio de la cubeta siguiente, lo que
+    mantiene picos y valles que un promedio o un muestreo regular borrarían.
+    """
+    n = len(x)
+    if puntos >= n or puntos < 3: return np.arange(n)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    bordes = np.linspace(1, n - 1, puntos - 1).astype(np.int64)  # Cubetas [bordes[i], bordes[i+1])
+    elegidos = np.empty(puntos, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    a = 0
+    for i in range(puntos - 2):
+        ini, fin = bordes[i], bordes[i + 1]
+        sig_fin = bordes[i + 2] if i + 2 < len(bordes) else n
+        cx, cy = x[fin:sig_fin].mean(), y[fin:sig_fin].mean()
+        area = np.abs((x[a] - cx) * (y[ini:fin] - y[a]) - (x[a] - x[ini:fin]) * (cy - y[a]))
+        a = ini + int(np.argmax(area))
+        elegidos[i + 1] = a
+    return elegidos
+
+def reducir_serie(serie, puntos=PUNTOS_TENDENCIA):
+    """Aplica LTTB a una serie ['F_S', 'Ingresos'] si supera el presupuesto de puntos."""
+    if len(serie) <= puntos: return serie
+    x = serie["F_S"].to_numpy().astype("datetime64[ns]").astype(np.int64)
+    return serie.iloc[lttb(x, serie["Ingresos"].to_numpy(), puntos)].reset_index(drop=True)
+
+class AgregadosKPI:
+    """Contadores por hora, día, municipio (texto) y líder, mantenidos por anexado.
+
+    El héroe, los KPIs y la tendencia se responden desde estas tablas, cuyo
+    tamaño depende de horas/municipios/líderes distintos y no de las filas.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reiniciar(None)
+
+    def _reiniciar(self, generacion):
+        self.generacion = generacion
+        self.filas = 0
+        self.total = 0
+        self.por_hora, self.por_dia, self.por_ciudad, self.por_lider = {}, {}, {}, {}
+        self.por_semana = {}  # Lunes 00:00 de cada semana -> registros
+
+    @staticmethod
+    def _sumar(destino, conteos):
+        for clave, n in conteos.items():
+            if n: destino[clave] = destino.get(clave, 0) + int(n)  # Las categorías sin uso traen 0
+
+    @METRICAS.medido("aggregate", "kpis")
+    def sincronizar(self, df, generacion):
+        with self.lock:
+            if generacion != self.generacion: self._reiniciar(generacion)
+            if len(df) <= self.filas: return  # Sin filas nuevas, o copia atrasada de la misma generación
+            nuevas = df.iloc[self.filas:]
+            if 'Fecha Registro' in nuevas.columns:
+                horas = nuevas['Fecha Registro'].dropna().dt.floor('h')
+                self._sumar(self.por_hora, horas.value_counts())
+                self._sumar(self.por_dia, horas.dt.date.value_counts())
+                self._sumar(self.por_semana, _inicio_cubeta(horas, "W").value_counts())
+            if 'Ciudad' in nuevas.columns: self._sumar(self.por_ciudad, nuevas['Ciudad'].value_counts())
+            if 'Registrado Por' in nuevas.columns: self._sumar(self.por_lider, nuevas['Registrado Por'].value_counts())
+            self.total += len(nuevas)
+            self.filas = len(df)
+
+    def conteo_rango(self, desde, hasta=None):
+        desde = pd.Timestamp(desde).floor('h')
+        hasta = pd.Timestamp(hasta) if hasta is not None else None
+        with self.lock:
+            return sum(n for h, n in self.por_hora.items() if h >= desde and (hasta is None or h < hasta))
+
+    def tabla(self, conteos, columnas, limite=None):
+        with self.lock: pares = sorted(conteos.items(), key=lambda kv: kv[1], reverse=True)
+        return pd.DataFrame(pares[:limite] if limite else pares, columns=columnas)
+
+    def serie(self, frecuencia, desde=None, hasta=None):
+        """Serie por hora ('h'), día ('D') o semana ('W') leída de las cubetas, sin tocar filas."""
+        with self.lock: conteos = dict({"h": self.por_hora, "D": self.por_dia, "W": self.por_semana}[frecuencia])
+        return completar_serie(conteos, frecuencia, desde, hasta)
+
+    def extension(self):
+        with self.lock:
+            if not self.por_hora: return None, None
+            return min(self.por_hora), max(self.por_hora)
+
+@st.cache_resource
+def get_agregados_kpi():
+    return AgregadosKPI()
+
+class CuboRegistros:
+    """Conteos por (líder, código DANE, día), mantenidos por anexado.
+
+    Responde los cortes y agregaciones (roll-up) del detalle por líder sin
+    recorrer las filas: su tamaño crece con líderes × municipios × días
+    activos, no con los registros. La ciudad se resuelve con el
+    ResolvedorMunicipios y lo que no se resuelve queda con código "". Las filas
+    sin fecha no entran al cubo.
+    """
+    DIMENSIONES = ["lider", "codigo", "dia"]
+
+    def __init__(self, obtener_resolvedor):
+        self.lock = threading.Lock()
+        self.obtener_resolvedor = obtener_resolvedor
+        self._reiniciar(None)
+
+    def _reiniciar(self, generacion):
+        self.generacion = generacion
+        self.filas = 0
+        self.celdas = {}     # (líder, código, día) -> registros
+        self._tabla = None   # Vista columnar de celdas, se rehace tras cada anexado
+
+    @METRICAS.medido("aggregate", "cubo")
+    def sincronizar(self, df, generacion):
+        with self.lock:
+            if generacion != self.generacion: self._reiniciar(generacion)
+            if len(df) <= self.filas: return  # Sin filas nuevas, o copia atrasada de la misma generación
+            nuevas = df.iloc[self.filas:]
+            self.filas = len(df)
+            if 'Fecha Registro' not in nuevas.columns: return
+            resolvedor = self.obtener_resolvedor()
+            vacio = np.full(len(nuevas), "", dtype=object)
+            claves = pd.DataFrame({
+                "lider": nuevas['Registrado Por'].astype("string").fillna("").to_numpy(object) if 'Registrado Por' in nuevas.columns else vacio,
+                "codigo": (resolvedor.resolver_serie(nuevas['Ciudad']).fillna("").to_numpy(object)
+                           if resolvedor and 'Ciudad' in nuevas.columns else vacio),
+                "dia": nuevas['Fecha Registro'].dt.normalize().to_numpy(),
+            }).dropna(subset=["dia"])
+            for clave, n in claves.groupby(self.DIMENSIONES, sort=False).size().items():
+                self.celdas[clave] = self.celdas.get(clave, 0) + int(n)
+            self._tabla = None
+
+    def _vista(self):
+        with self.lock:
+            if self._tabla is None:
+                self._tabla = pd.DataFrame(list(self.celdas), columns=self.DIMENSIONES).assign(
+                    n=np.fromiter(self.celdas.values(), dtype=np.int64, count=len(self.celdas)))
+            return self._tabla
+
+    def cortar(self, lider=None, codigo=None, desde=None, hasta=None):
+        """Celdas que cumplen los filtros (lider/codigo aceptan un valor o una lista)."""
+        t = self._vista()
+        m = np.ones(len(t), dtype=bool)
+        for dim, valor in (("lider", lider), ("codigo", codigo)):
+            if valor is None: continue
+            m &= t[dim].isin(valor if isinstance(valor, (list, tuple, set)) else [valor]).to_numpy()
+        if desde is not None: m &= (t["dia"] >= pd.Timestamp(desde).normalize()).to_numpy()
+        if hasta is not None: m &= (t["dia"] < pd.Timestamp(hasta)).to_numpy()
+        return t[m]
+
+    def agregar(self, por, **filtros):
+        """Roll-up: suma n por las dimensiones de `por` dentro del corte."""
+        corte = self.cortar(**filtros)
+        if not por: return pd.DataFrame({"n": [int(corte["n"].sum())]})
+        return corte.groupby(por, sort=False)["n"].sum().reset_index()
+
+@st.cache_resource
+def get_cubo():
+    return CuboRegistros(get_resolvedor)
+
+class CacheFiguras:
+    """Figuras Plotly serializadas, direccionadas por contenido.
+
+    La clave es un hash de todo lo que determina la figura (datos, versión de
+    la geometría, parámetros de diseño), así que dos vistas o dos versiones de
+    datos con los mismos conteos comparten la entrada. Se guarda el JSON: su
+    tamaño es exacto y se desaloja por LRU al pasar de max_bytes o max_entradas.
+    """
+    def __init__(self, max_bytes, max_entradas):
+        self.max_bytes = max_bytes
+        self.max_entradas = max_entradas
+        self.lock = threading.Lock()
+        self.entradas = OrderedDict()  # clave -> JSON
+        self.bytes = 0
+
+    def obtener(self, clave, construir):
+        """JSON de la figura; construir() solo corre si falta (y puede devolver None)."""
+        with self.lock:
+            if clave in self.entradas:
+                self.entradas.move_to_end(clave)
+                return self.entradas[clave]
+        serializada = construir()
+        if serializada is None: return None
+        with self.lock:
+            if clave not in self.entradas:
+                self.entradas[clave] = serializada
+                self.bytes += len(serializada)
+                while self.entradas and (self.bytes > self.max_bytes or len(self.entradas) > self.max_entradas):
+                    _, desalojada = self.entradas.popitem(last=False)
+                    self.bytes -= len(desalojada)
+                    METRICAS.contar("figuras_desalojadas")
+            METRICAS.tamano("cache_figuras", self.bytes)
+        return serializada
+
+@st.cache_resource
+def get_cache_figuras():
+    return CacheFiguras(MEMORIA_CACHE_FIGURAS_MB * 1024 * 1024, ENTRADAS_CACHE_FIGURAS)
+
+def _solo_digitos(serie):
+    return serie.astype(str).str.replace(r"\D", "", regex=True)
+
+class IndiceDuplicados:
+    """Conjuntos hash de cédulas y teléfonos ya registrados.
+
+    Se alimenta del snapshot (solo las filas nuevas de cada generación) y de
+    las reservas hechas por save_data, que cubren lo que aún está en el
+    journal o no ha llegado al snapshot. Una reserva se descarta cuando su
+    cédula aparece en el snapshot. Tras un reinicio, las reservas se
+    reconstruyen desde las filas pendientes del journal.
+    """
+    def __init__(self, pendientes=()):
+        self.lock = threading.Lock()
+        self.generacion = None
+        self.filas = 0
+        self.cedulas, self.telefonos = set(), set()
+        self.reservas = {}  # cédula -> teléfono
+        for fila in pendientes:
+            ced, tel = _solo_digitos(pd.Series(fila[3:5], dtype=object)).tolist()
+            if ced: self.reservas[ced] = tel
+
+    @METRICAS.medido("aggregate", "duplicados")
+    def sincronizar(self, df, generacion):
+        with self.lock:
+            if generacion != self.generacion:
+                self.generacion, self.filas = generacion, 0
+                self.cedulas, self.telefonos = set(), set()
+            if len(df) <= self.filas: return
+            nuevas = df.iloc[self.filas:]
+            if 'Cédula' in nuevas.columns: self.cedulas.update(_solo_digitos(nuevas['Cédula']).unique())
+            if 'Teléfono' in nuevas.columns: self.telefonos.update(_solo_digitos(nuevas['Teléfono']).unique())
+            self.cedulas.discard("")
+            self.telefonos.discard("")
+            for ced in [c for c in self.reservas if c in self.cedulas]: del self.reservas[ced]
+            self.filas = len(df)
+
+    def reservar(self, cedula, telefono):
+        """Verifica y reserva en un solo paso (seguro entre sesiones concurrentes).
+
+        Retorna (reservada, telefono_repetido); no reserva si la cédula existe.
+        Una cédula sin dígitos ("N/A", pasaporte en letras) no tiene con qué
+        compararse: se acepta sin reserva, como antes de existir el índice.
+        """
+        ced, tel = re.sub(r"\D", "", str(cedula)), re.sub(r"\D", "", str(telefono))
+        with self.lock:
+            if ced in self.cedulas or ced in self.reservas: return False, False
+            tel_repetido = bool(tel) and (tel in self.telefonos or tel in self.reservas.values())
+            if ced: self.reservas[ced] = tel
+            return True, tel_repetido
+
+    def liberar(self, cedula):
+        with self.lock: self.reservas.pop(re.sub(r"\D", "", str(cedula)), None)
+
+    def reservar_lote(self, cedulas, telefonos):
+        """reservar() para una serie completa (cédulas y teléfonos ya en dígitos).
+
+        Retorna máscaras (reservada, ya_existia, telefono_repetido); de una
+        cédula repetida dentro del mismo lote solo se reserva la primera.
+        """
+        with self.lock:
+            existia = np.fromiter((c in self.cedulas or c in self.reservas for c in cedulas), bool, len(cedulas))
+            reservada = (cedulas != "").to_numpy() & ~existia & ~cedulas.duplicated().to_numpy()
+            en_reserva = set(self.reservas.values())
+            tel_repetido = np.fromiter((t != "" and (t in self.telefonos or t in en_reserva) for t in telefonos),
+                                       bool, len(telefonos))
+            self.reservas.update(zip(cedulas[reservada], telefonos[reservada]))
+        return reservada, existia, tel_repetido
+
+    def liberar_lote(self, cedulas):
+        with self.lock:
+            for c in cedulas: self.reservas.pop(c, None)
+
+@st.cache_resource
+def get_indice_duplicados():
+    try: pendientes = get_cola_escritura().filas_pendientes()
+    except Exception as e:
+        METRICAS.error("journal_pendientes", e)
+        pendientes = []
+    return IndiceDuplicados(pendientes)
+
+# --- 7. LÓGICA DE AUTENTICACIÓN ---
 def check_auth():
     if "logged_in" not in st.session_state: st.session_state.logged_in = False
     
@@ -232,10 +2364,14 @@ def check_auth():
         return False
     return True
 
-# --- 6. VISTAS ---
+# --- 8. VISTAS ---
 def view_registro():
     st.title("🗳️ Nuevo Registro")
     if "f_reset" not in st.session_state: st.session_state.f_reset = 0
+    if st.session_state.pop("registro_ok", False):
+        st.success("¡Registro guardado exitosamente!")
+    aviso = st.session_state.pop("registro_aviso", None)
+    if aviso: st.warning(aviso)
     
     with st.form(key=f"form_pulse_{st.session_state.f_reset}"):
         c1, c2 = st.columns(2)
@@ -252,29 +2388,248 @@ def view_registro():
         
         if st.form_submit_button("GUARDAR REGISTRO"):
             if nom and ced and tel:
+                duplicados = get_indice_duplicados()
+                duplicados.sincronizar(*get_snapshot())
+                reservada, tel_repetido = duplicados.reservar(ced, tel)
+                if not reservada:
+                    st.error(f"La cédula {ced} ya está registrada.")
+                    return
                 success = save_data({
                     "nombre": nom.upper(), "cedula": ced, "telefono": tel,
                     "ocupacion": ocu.upper(), "direccion": dir.upper(),
                     "barrio": bar.upper(), "ciudad": ciu.upper(), "puesto": pue.upper()
                 })
                 if success:
-                    st.success("¡Registro guardado exitosamente!")
+                    st.session_state.registro_ok = True
+                    if tel_repetido: st.session_state.registro_aviso = f"El teléfono {tel} ya figura en otro registro."
                     st.session_state.f_reset += 1
-                    time.sleep(1)
                     st.rerun()
-                else: st.error("Fallo al guardar en la base de datos.")
+                else:
+                    duplicados.liberar(ced)
+                    st.error("Fallo al guardar en la base de datos.")
             else: st.warning("Complete los campos obligatorios.")
 
-def view_estadisticas():
-    df = get_data()
-    if df.empty:
-        st.info("Cargando base de datos...")
-        return
+def view_importacion():
+    st.title("📥 Importación Masiva")
+    st.caption("CSV o Excel con encabezados Nombre, Cédula, Teléfono, Ocupación, Dirección, Barrio, "
+               "Municipio y Puesto. Si la carga se interrumpe, suba el mismo archivo para continuar.")
+    archivo = st.file_uploader("Archivo", type=["csv", "xlsx"] if openpyxl else ["csv"])
+    if archivo is None: return
+    importador = get_importador()
+    id_importacion = importador.huella_archivo(archivo)
+    estado = importador.estado(id_importacion)
+    if estado and estado["completa"]:
+        st.info(f"Este archivo ya fue importado por {estado['usuario']}: {estado['aceptadas']:,} registros aceptados.")
+    elif estado:
+        st.warning(f"Importación interrumpida: {estado['procesadas']:,} filas ya procesadas; se continuará desde ahí.")
+    if not (estado and estado["completa"]) and st.button("IMPORTAR REGISTROS"):
+        avance = st.empty()
+        def al_avanzar(e):
+            avance.info(f"Procesadas {e['procesadas']:,} · aceptadas {e['aceptadas']:,} · rechazadas {e['rechazadas']:,}")
+        try:
+            _, estado = importador.importar(archivo, archivo.name, st.session_state.user_name, al_avanzar)
+        except Exception as e:
+            METRICAS.error("importacion", e)
+            st.error(f"La importación se detuvo: {e}. Suba de nuevo el archivo para continuar.")
+            return
+        avance.success(f"{estado['aceptadas']:,} registros en cola de envío; {estado['rechazadas']:,} filas rechazadas.")
+    if estado and estado["rechazadas"]:
+        errores = importador.errores(id_importacion)
+        st.write(f"**Filas rechazadas ({len(errores):,})**")
+        st.dataframe(errores.head(500), use_container_width=True, hide_index=True)
+        st.download_button("Descargar reporte de errores", errores.to_csv(index=False).encode("utf-8-sig"),
+                           file_name=f"errores_{os.path.splitext(archivo.name)[0]}.csv", mime="text/csv")
 
-    st.title("Pulse Analytics | Valle del Cauca")
+# Cada sección del tablero es un fragmento: se refresca sola cada tantos segundos
+# y sus datos se memorizan por versión de datos, así que un rerun que no trae
+# filas nuevas no recalcula nada.
+@METRICAS.contar_cache("kpis")
+@st.cache_data(max_entries=16, show_spinner=False)
+def _datos_kpis(version, hora):
+    """KPIs del héroe; hora entra en la clave porque las ventanas se desplazan."""
+    METRICAS.cache_fallo("kpis")
+    backend = get_backend()
+    hoy = datetime.now()
+    inicio_hoy = datetime.combine(hoy.date(), datetime.min.time())
+    return {
+        "total": backend.total(),
+        "hoy": backend.conteo_rango(inicio_hoy, inicio_hoy + timedelta(days=1)),
+        "8d": backend.conteo_rango(hoy - timedelta(days=8)),
+        "30d": backend.conteo_rango(hoy - timedelta(days=30)),
+    }
+
+@METRICAS.contar_cache("municipios")
+@st.cache_data(max_entries=8, show_spinner=False)
+def _datos_municipios(version):
+    METRICAS.cache_fallo("municipios")
+    resolvedor = get_resolvedor()
+    if not resolvedor: return None
+    return conteo_por_municipio(get_backend().conteo_por_ciudad(), resolvedor)
+
+def _cubo_vigente():
+    """Cubo al día con el snapshot publicado (sin efecto si el publicador ya lo sincronizó)."""
+    cubo = get_cubo()
+    cubo.sincronizar(*get_snapshot())
+    return cubo
+
+def _version_cubo():
+    """Versión del snapshot publicado, que es lo que sigue el cubo (el backend SQL puede ir adelante)."""
+    get_snapshot()
+    return get_backend().publicador.version
+
+@METRICAS.contar_cache("lideres")
+@st.cache_data(max_entries=8, show_spinner=False)
+def _datos_lideres(version, limite=None):
+    METRICAS.cache_fallo("lideres")
+    return get_backend().ranking_lideres(limite)
+
+def _inicio_periodo(periodo):
+    hoy = pd.Timestamp.now().normalize()
+    if periodo == "Esta semana": return hoy - pd.Timedelta(days=hoy.dayofweek)
+    if periodo == "Últimos 30 días": return hoy - pd.Timedelta(days=30)
+    return None
+
+@METRICAS.contar_cache("detalle_lider")
+@st.cache_data(max_entries=32, show_spinner=False)
+def _datos_detalle_lider(version, lider, desde):
+    """Municipios (con nombre) y serie diaria de un líder, salidos del cubo."""
+    METRICAS.cache_fallo("detalle_lider")
+    cubo = _cubo_vigente()
+    municipios = cubo.agregar(["codigo"], lider=lider, desde=desde).sort_values("n", ascending=False)
+    resolvedor = get_resolvedor()
+    nombres = resolvedor.nombres if resolvedor else {}
+    municipios = pd.DataFrame({
+        "MPIO_CCNCT": municipios["codigo"].replace("", None).to_numpy(),
+        "ID_MPIO": municipios["codigo"].map(nombres).fillna("SIN MUNICIPIO").to_numpy(),
+        "Registros": municipios["n"].to_numpy()})
+    dias = cubo.agregar(["dia"], lider=lider, desde=desde)
+    serie = completar_serie(dict(zip(dias["dia"], dias["n"])), "D")
+    return municipios, serie
+
+def _figura_mapa_lider(version, lider, desde, nivel):
+    municipios, _ = _datos_detalle_lider(version, lider, desde)
+    return figura_mapa_cacheada(municipios, nivel, ALTO_MAPA_DETALLE_PX)
+
+@METRICAS.contar_cache("tendencia")
+@st.cache_data(max_entries=16, show_spinner=False)
+def _datos_tendencia(version, frecuencia, desde, hasta):
+    """Serie del rango pedido desde las cubetas, ya reducida a PUNTOS_TENDENCIA; retorna (serie, puntos originales)."""
+    METRICAS.cache_fallo("tendencia")
+    serie = get_backend().conteo_por_periodo(frecuencia, desde, hasta)
+    return reducir_serie(serie), len(serie)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _extension_tendencia(version):
+    return get_backend().extension_temporal()
+
+def _figura_mapa(version, nivel):
+    counts = _datos_municipios(version)
+    return figura_mapa_cacheada(counts, nivel) if counts is not None else None
+
+def clave_figura(counts, *parametros):
+    """Hash del contenido de counts que llega al mapa (código y total) y de los parámetros."""
+    tabla = (counts.dropna(subset=['MPIO_CCNCT'])[['MPIO_CCNCT', 'Registros']]
+             .astype({'MPIO_CCNCT': str, 'Registros': 'int64'}).sort_values('MPIO_CCNCT'))
+    h = hashlib.blake2b(repr(parametros).encode(), digest_size=16)
+    h.update(pd.util.hash_pandas_object(tabla, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+@METRICAS.contar_cache("figura_mapa")
+def figura_mapa_cacheada(counts, nivel, alto=ALTO_MAPA_PX):
+    """Coroplético desde CacheFiguras; solo se construye y valida si su contenido es nuevo."""
+    ruta = _ruta_artefacto_geo(DPTO_VALLE)
+    version_geo = (VERSION_GEO, nivel, os.path.getmtime(ruta) if os.path.exists(ruta) else 0)
+
+    def construir():
+        METRICAS.cache_fallo("figura_mapa")
+        geojson_data = get_geojson_dpto(DPTO_VALLE, nivel)
+        if not geojson_data: return None
+        with METRICAS.medir("render", "figura_mapa"):
+            fig = construir_figura_mapa(counts, geojson_data, get_etiquetas_geo(), alto)
+        with METRICAS.medir("render", "serializar_mapa"): serializada = fig.to_json()
+        METRICAS.tamano("figura_mapa", len(serializada))  # Lo que viaja al navegador en cada envío
+        return serializada
+
+    serializada = get_cache_figuras().obtener(clave_figura(counts, version_geo, alto), construir)
+    if serializada is None: return None
+    # st.plotly_chart revalida los dict reconstruyendo la figura; un Figure armado
+    # sin validación (el JSON ya salió de una figura válida) pasa directo a to_json
+    return go.Figure(json.loads(serializada), _validate=False)
+
+def construir_figura_mapa(counts, geojson_data, etiquetas, alto=ALTO_MAPA_PX):
+    """Coroplético municipal con etiquetas; counts viene de conteo_por_municipio."""
+    map_data_full = etiquetas[['MPIO_CCNCT', 'ID_MPIO']].merge(
+        counts[['MPIO_CCNCT', 'Registros']].dropna(subset=['MPIO_CCNCT']), on='MPIO_CCNCT', how='left').fillna(0)
+    
+    fig = px.choropleth(
+        map_data_full, 
+        geojson=geojson_data, 
+        locations='MPIO_CCNCT',
+        hover_name='ID_MPIO',
+        color='Registros',
+        color_continuous_scale=[[0, 'white'], [0.0001, '#FCE4EC'], [1, '#E91E63']],
+        labels={'Registros': 'Total'}
+    )
+    
+    # Etiquetas más visibles
+    fig.add_trace(go.Scattergeo(
+        lat=etiquetas['lat'],
+        lon=etiquetas['lon'],
+        text=etiquetas['ID_MPIO'],
+        mode='text',
+        textfont=dict(size=11, color="black", family="Plus Jakarta Sans", weight="bold"),
+        hoverinfo='none',
+        showlegend=False
+    ))
+    
+    # Forzamos que el mapa use todo el canvas sin bordes internos
+    fig.update_geos(
+        fitbounds="locations",
+        visible=False,
+        projection_type="mercator"
+    )
+    
+    fig.update_traces(
+        marker_line_width=1.8,
+        marker_line_color="black",
+        selector=dict(type='choropleth')
+    )
     
+    # Altura al máximo y márgenes a cero absoluto
+    fig.update_layout(
+        margin={"r":0,"t":0,"l":0,"b":0}, 
+        height=alto,
+        paper_bgcolor="white",
+        plot_bgcolor="white",
+        coloraxis_colorbar=dict(
+            title="REGISTROS", 
+            thickness=25, 
+            len=0.5, 
+            yanchor="middle", 
+            y=0.5,
+            xanchor="left",
+            x=0.02
+        ),
+        autosize=True
+    )
+    return fig
+
+def _version_datos():
+    try: return get_backend().version()
+    except Exception as e:
+        METRICAS.error("version_datos", e)
+        return (0, 0)
+
+@st.fragment(run_every=INTERVALOS_SECCION["kpis"])
+@METRICAS.medido("render", "seccion_kpis")
+def seccion_hero_kpis():
+    version = _version_datos()
+    kpis = _datos_kpis(version, datetime.now().strftime("%Y-%m-%d %H"))
+    counts = _datos_municipios(version)
+    municipios_activos = counts['MPIO_CCNCT'].nunique() if counts is not None else 0
+
     # --- HERO ---
-    total = len(df)
+    total = kpis["total"]
     perc = min((total / META_REGISTROS) * 100, 100)
     st.markdown(f"""
         <div class="pulse-hero">
@@ -293,156 +2648,268 @@ def view_estadisticas():
     """, unsafe_allow_html=True)
 
     # --- KPIs ---
-    hoy = datetime.now()
-    df['F_S'] = df['Fecha Registro'].dt.date
-    v_hoy = len(df[df['F_S'] == hoy.date()])
-    v_8d = len(df[df['Fecha Registro'] > (hoy - timedelta(days=8))])
-    v_30d = len(df[df['Fecha Registro'] > (hoy - timedelta(days=30))])
-
     k1, k2, k3, k4 = st.columns(4)
-    metricas = [("Hoy", v_hoy), ("Últ. 8 días", v_8d), ("Últ. 30 días", v_30d), ("Municipios", df['Ciudad'].nunique())]
+    metricas = [("Hoy", kpis["hoy"]), ("Últ. 8 días", kpis["8d"]), ("Últ. 30 días", kpis["30d"]), ("Municipios", municipios_activos)]
     for col, (lab, val) in zip([k1, k2, k3, k4], metricas):
         col.markdown(f"""<div class="pulse-kpi-card"><div class="kpi-label">{lab}</div><div class="kpi-val">{val:,}</div></div>""", unsafe_allow_html=True)
 
+@st.fragment(run_every=INTERVALOS_SECCION["mapa"])
+@METRICAS.medido("render", "seccion_mapa")
+def seccion_mapa():
+    version = _version_datos()
+    fig = _figura_mapa(version, elegir_nivel_geo(ALTO_MAPA_PX))
+    if fig is not None:
+        st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+    else:
+        st.error("⚠️ No se pudo cargar el mapa.")
+        counts = _datos_municipios(version)
+        if counts is not None: st.dataframe(counts, use_container_width=True)
+
+@st.fragment(run_every=INTERVALOS_SECCION["ranking"])
+@METRICAS.medido("render", "seccion_ranking")
+def seccion_ranking_municipal():
+    counts = _datos_municipios(_version_datos())
+    st.write("**🔥 Ranking Municipal**")
+    ranking_mpios = counts.head(20) if counts is not None else pd.DataFrame(columns=['ID_MPIO', 'Registros'])
+    for _, row in ranking_mpios.iterrows(): # Más municipios visibles
+        st.markdown(f"""
+            <div class="rank-item" style="padding:8px; margin-bottom:6px; border-radius:12px;">
+                <span style="font-weight:600; font-size:0.75rem;">{row['ID_MPIO']}</span>
+                <span class="hotspot-pill" style="font-size:0.7rem; padding:2px 8px;">{row['Registros']}</span>
+            </div>
+        """, unsafe_allow_html=True)
+    
+    st.markdown("---")
+    municipios_activos = counts['MPIO_CCNCT'].nunique() if counts is not None else 0
+    st.metric("Municipios", f"{municipios_activos}/{MUNICIPIOS_VALLE_TOTAL}")
+
+@st.fragment(run_every=INTERVALOS_SECCION["leaderboard"])
+@METRICAS.medido("render", "seccion_leaderboard")
+def seccion_leaderboard():
+    st.subheader("🏆 Leaderboard de Líderes")
+    ranking = _datos_lideres(_version_datos(), 8)
+    for i, row in ranking.iterrows():
+        st.markdown(f"""
+            <div class="rank-item">
+                <div style="display:flex; align-items:center;">
+                    <div class="rank-num">{i+1}</div>
+                    <span class="rank-name">{row['Líder'].upper()}</span>
+                </div>
+                <span class="rank-badge">{row['Total']} regs</span>
+            </div>
+        """, unsafe_allow_html=True)
+
+@st.fragment(run_every=INTERVALOS_SECCION["tendencia"])
+@METRICAS.medido("render", "seccion_tendencia")
+def seccion_tendencia():
+    st.subheader("📈 Actividad Histórica")
+    version = _version_datos()
+    inicio, fin = _extension_tendencia(version)
+    if inicio is None or pd.isna(inicio):
+        st.caption("Sin actividad registrada.")
+        return
+    rango = st.date_input("Rango", value=(inicio.date(), fin.date()), min_value=inicio.date(),
+                          max_value=fin.date(), format="DD/MM/YYYY", label_visibility="collapsed")
+    desde = pd.Timestamp(rango[0]) if rango else inicio.normalize()
+    hasta = pd.Timestamp(rango[1] if len(rango) > 1 else fin.date()) + pd.Timedelta(days=1)  # Día final incluido
+    frecuencia = elegir_frecuencia(desde, hasta)
+    trend, puntos = _datos_tendencia(version, frecuencia, desde, hasta)
+    fig_trend = px.area(trend, x='F_S', y='Ingresos', color_discrete_sequence=['#E91E63'])
+    fig_trend.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', height=380, xaxis_title=None, yaxis_title=None)
+    st.plotly_chart(fig_trend, use_container_width=True)
+    nombre = {"h": "hora", "D": "día", "W": "semana"}[frecuencia]
+    st.caption(f"Por {nombre} · {len(trend):,} de {puntos:,} puntos")
+
+@st.fragment(run_every=INTERVALOS_SECCION["detalle"])
+@METRICAS.medido("render", "seccion_detalle")
+def seccion_detalle_lider():
+    st.subheader("🔎 Detalle por Líder")
+    version = _version_cubo()
+    lideres = _datos_lideres(_version_datos())
+    if lideres.empty:
+        st.caption("Sin registros todavía.")
+        return
+    c_lider, c_periodo = st.columns([2, 1])
+    lider = c_lider.selectbox("Líder", lideres["Líder"].tolist(), key="detalle_lider")
+    periodo = c_periodo.selectbox("Periodo", PERIODOS_DETALLE, key="detalle_periodo")
+    desde = _inicio_periodo(periodo)
+    municipios, serie = _datos_detalle_lider(version, lider, desde)
+
+    k1, k2, k3 = st.columns(3)
+    for col, (lab, val) in zip([k1, k2, k3], [("Registros", int(municipios["Registros"].sum())),
+                                               ("Municipios", int(municipios["MPIO_CCNCT"].notna().sum())),
+                                               ("Días activos", int((serie["Ingresos"] > 0).sum()))]):
+        col.markdown(f"""<div class="pulse-kpi-card"><div class="kpi-label">{lab}</div><div class="kpi-val">{val:,}</div></div>""", unsafe_allow_html=True)
+
+    c_mapa, c_datos = st.columns([3, 2])
+    with c_mapa:
+        fig = _figura_mapa_lider(version, lider, desde, elegir_nivel_geo(ALTO_MAPA_DETALLE_PX))
+        if fig is not None: st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+    with c_datos:
+        st.dataframe(municipios[["ID_MPIO", "Registros"]].rename(columns={"ID_MPIO": "Municipio"}),
+                     use_container_width=True, hide_index=True, height=260)
+        fig_dias = px.bar(serie, x='F_S', y='Ingresos', color_discrete_sequence=['#E91E63'])
+        fig_dias.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', height=240,
+                               margin={"r": 0, "t": 10, "l": 0, "b": 0}, xaxis_title=None, yaxis_title=None)
+        st.plotly_chart(fig_dias, use_container_width=True)
+
+def view_estadisticas():
+    backend = get_backend()
+    try: total = backend.total()
+    except Exception as e:
+        METRICAS.error("total", e)
+        total = 0
+    if not total:
+        st.info("Cargando base de datos...")
+        return
+
+    st.title("Pulse Analytics | Valle del Cauca")
+    seccion_hero_kpis()
+
     # --- MAPA MAXIMIZADO SIN LÍMITES ---
     st.markdown("<br>", unsafe_allow_html=True)
     st.subheader("📍 Visualización Territorial Completa")
     
-    m_df = df.copy()
-    m_df['ID_MPIO'] = m_df['Ciudad'].apply(normalizar_para_mapa).apply(normalizar)
-    counts = m_df['ID_MPIO'].value_counts().reset_index()
-    counts.columns = ['ID_MPIO', 'Registros']
-    
     # Ajustamos proporciones para eliminar el efecto "encerrado" [5, 1]
     c_map_view, c_map_stats = st.columns([5, 1])
-    
-    with c_map_view:
-        geojson_data = get_valle_geojson(URL_GITHUB_GEO)
-        if geojson_data:
-            all_features = geojson_data["features"]
-            all_ids = [f["id"] for f in all_features]
-            
-            lats, lons, names = [], [], []
-            for f in all_features:
-                coords = f["geometry"]["coordinates"]
-                if f["geometry"]["type"] == "Polygon":
-                    coords_flat = np.array(coords[0])
-                else: # MultiPolygon
-                    coords_flat = np.array([c for sub in coords for c in sub[0]])
-                
-                lons.append(coords_flat[:, 0].mean())
-                lats.append(coords_flat[:, 1].mean())
-                names.append(f["id"])
-
-            df_base = pd.DataFrame({"ID_MPIO": all_ids})
-            map_data_full = df_base.merge(counts, on='ID_MPIO', how='left').fillna(0)
-            
-            fig = px.choropleth(
-                map_data_full, 
-                geojson=geojson_data, 
-                locations='ID_MPIO',
-                color='Registros',
-                color_continuous_scale=[[0, 'white'], [0.0001, '#FCE4EC'], [1, '#E91E63']],
-                labels={'Registros': 'Total'}
-            )
-            
-            # Etiquetas más visibles
-            fig.add_trace(go.Scattergeo(
-                lat=lats,
-                lon=lons,
-                text=names,
-                mode='text',
-                textfont=dict(size=11, color="black", family="Plus Jakarta Sans", weight="bold"),
-                hoverinfo='none',
-                showlegend=False
-            ))
-            
-            # Forzamos que el mapa use todo el canvas sin bordes internos
-            fig.update_geos(
-                fitbounds="locations",
-                visible=False,
-                projection_type="mercator"
-            )
-            
-            fig.update_traces(
-                marker_line_width=1.8,
-                marker_line_color="black",
-                selector=dict(type='choropleth')
-            )
-            
-            # Altura al máximo y márgenes a cero absoluto
-            fig.update_layout(
-                margin={"r":0,"t":0,"l":0,"b":0}, 
-                height=1000,
-                paper_bgcolor="white",
-                plot_bgcolor="white",
-                coloraxis_colorbar=dict(
-                    title="REGISTROS", 
-                    thickness=25, 
-                    len=0.5, 
-                    yanchor="middle", 
-                    y=0.5,
-                    xanchor="left",
-                    x=0.02
-                ),
-                autosize=True
-            )
-            st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
-        else:
-            st.error("⚠️ No se pudo cargar el mapa.")
-            st.dataframe(counts, use_container_width=True)
-
-    with c_map_stats:
-        st.write("**🔥 Ranking Municipal**")
-        for _, row in counts.head(20).iterrows(): # Más municipios visibles
-            st.markdown(f"""
-                <div class="rank-item" style="padding:8px; margin-bottom:6px; border-radius:12px;">
-                    <span style="font-weight:600; font-size:0.75rem;">{row['ID_MPIO']}</span>
-                    <span class="hotspot-pill" style="font-size:0.7rem; padding:2px 8px;">{row['Registros']}</span>
-                </div>
-            """, unsafe_allow_html=True)
-        
-        st.markdown("---")
-        st.metric("Municipios", f"{len(counts)}/42")
+    with c_map_view: seccion_mapa()
+    with c_map_stats: seccion_ranking_municipal()
 
     # --- LEADERBOARD ---
     st.markdown("---")
     c_rank, c_trend = st.columns([1, 1.5])
-    
-    with c_rank:
-        st.subheader("🏆 Leaderboard de Líderes")
-        ranking = df['Registrado Por'].value_counts().reset_index()
-        ranking.columns = ['Líder', 'Total']
-        for i, row in ranking.head(8).iterrows():
-            st.markdown(f"""
-                <div class="rank-item">
-                    <div style="display:flex; align-items:center;">
-                        <div class="rank-num">{i+1}</div>
-                        <span class="rank-name">{row['Líder'].upper()}</span>
-                    </div>
-                    <span class="rank-badge">{row['Total']} regs</span>
-                </div>
-            """, unsafe_allow_html=True)
+    with c_rank: seccion_leaderboard()
+    with c_trend: seccion_tendencia()
+
+    # --- DETALLE POR LÍDER ---
+    st.markdown("---")
+    seccion_detalle_lider()
+
+    with st.expander("⬇️ Exportar registros"):
+        df, _ = get_snapshot()
+        panel_exportacion(df, None, list(df.columns), "exportar_estadisticas")
+
+def panel_rendimiento():
+    """Tiempos por etapa, aciertos de caché y tamaños de carga de este proceso."""
+    resumen = METRICAS.resumen()
+    publicador = get_backend().publicador
+    st.caption(f"Snapshot publicado: generación {publicador.version[0]}, {publicador.version[1]:,} filas "
+               f"({publicador.publicaciones} publicaciones)")
+    if not resumen["etapas"]:
+        st.caption("Sin mediciones todavía.")
+    else:
+        etapas = pd.DataFrame(resumen["etapas"])[["etapa", "parte", "n", "p50_ms", "p95_ms", "max_ms"]]
+        st.dataframe(etapas.round(1), hide_index=True, use_container_width=True)
+    cache = [{"caché": k, "aciertos": c["aciertos"], "fallos": c["fallos"], "tasa": f"{c['tasa']:.0%}"}
+             for k, c in resumen["cache"].items() if c["tasa"] is not None]
+    if cache: st.dataframe(pd.DataFrame(cache), hide_index=True, use_container_width=True)
+    if resumen["bytes"]:
+        st.dataframe(pd.DataFrame([{"carga": k, "KB": round(v / 1024, 1)} for k, v in resumen["bytes"].items()]),
+                     hide_index=True, use_container_width=True)
+    errores = {k[6:]: v for k, v in resumen["contadores"].items() if k.startswith("error_")}
+    if errores: st.warning("Errores: " + ", ".join(f"{k} ({v})" for k, v in errores.items()))
+    c1, c2 = st.columns(2)
+    c1.download_button("JSON", METRICAS.exportar_json(), file_name="pulse_metricas.jsonl", mime="application/x-ndjson")
+    c2.download_button("Prometheus", METRICAS.exportar_prometheus(), file_name="pulse_metricas.prom", mime="text/plain")
+
+def _leer_archivo(ruta):
+    with open(ruta, "rb") as f: return f.read()
+
+def _estado_exportacion(clave):
+    id_trabajo = st.session_state.get(f"{clave}_trabajo")
+    return get_exportador().estado(id_trabajo) if id_trabajo else None
+
+@st.fragment(run_every=INTERVALOS_SECCION["exportacion"])
+def _avance_exportacion(clave):
+    """Solo se dibuja mientras el trabajo corre; al terminar relanza la página,
+    que ya muestra el resultado sin fragmento (y sin sondeo)."""
+    estado = _estado_exportacion(clave)
+    if not estado or estado["terminado"]:
+        st.rerun()
+    st.progress(estado["escritas"] / max(estado["total"], 1),
+                text=f"Preparando {estado['archivo']}: {estado['escritas']:,} de {estado['total']:,} filas")
 
-    with c_trend:
-        st.subheader("📈 Actividad Histórica")
-        trend = df.groupby('F_S').size().reset_index(name='Ingresos')
-        fig_trend = px.area(trend, x='F_S', y='Ingresos', color_discrete_sequence=['#E91E63'])
-        fig_trend.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', height=380, xaxis_title=None, yaxis_title=None)
-        st.plotly_chart(fig_trend, use_container_width=True)
+def _resultado_exportacion(estado, clave):
+    """Error o botón de descarga del trabajo terminado, con opción de descartarlo.
+
+    El archivo se entrega con data invocable: solo se lee al pulsar descargar,
+    no en cada rerun de la página mientras el botón sigue a la vista."""
+    c_resultado, c_descartar = st.columns([4, 1])
+    if c_descartar.button("Descartar", key=f"{clave}_descartar"):
+        get_exportador().descartar(st.session_state.pop(f"{clave}_trabajo"))
+        st.rerun()
+    if estado["error"]:
+        c_resultado.error(f"La exportación falló: {estado['error']}")
+    elif os.path.exists(estado["ruta"]):
+        mime = next(m for ext, m in FORMATOS_EXPORTACION.values() if ext == estado["formato"])
+        c_resultado.download_button(f"Descargar {estado['archivo']} ({estado['total']:,} filas)",
+                                    partial(_leer_archivo, estado["ruta"]), file_name=estado["archivo"],
+                                    mime=mime, key=f"{clave}_descargar")
+
+def panel_exportacion(df, posiciones, columnas, clave):
+    """Filtros y formato de exportación sobre `posiciones` de df (None: todas las filas)."""
+    resolvedor = get_resolvedor()
+    municipios = {"Todos": None}
+    if resolvedor: municipios.update({n: c for c, n in sorted(resolvedor.nombres.items(), key=lambda x: x[1])})
+    c_mun, c_lider, c_fechas, c_formato = st.columns([2, 2, 2, 1])
+    municipio = c_mun.selectbox("Municipio", list(municipios), key=f"{clave}_municipio")
+    lider = c_lider.selectbox("Líder", ["Todos"] + _datos_lideres(_version_datos())["Líder"].tolist(), key=f"{clave}_lider")
+    rango = c_fechas.date_input("Fechas", value=[], format="DD/MM/YYYY", key=f"{clave}_fechas")
+    formato = c_formato.selectbox("Formato", formatos_exportacion(), key=f"{clave}_formato")
+    if st.button("Preparar archivo", key=f"{clave}_preparar"):
+        desde = pd.Timestamp(rango[0]) if rango else None
+        hasta = pd.Timestamp(rango[-1]) + pd.Timedelta(days=1) if rango else None  # Día final incluido
+        seleccion = filtrar_registros(df, posiciones, municipios[municipio], None if lider == "Todos" else lider,
+                                      desde, hasta, resolvedor)
+        st.session_state[f"{clave}_trabajo"] = get_exportador().iniciar(
+            df, seleccion, columnas, FORMATOS_EXPORTACION[formato][0], f"registros_{datetime.now():%Y%m%d_%H%M}")
+    estado = _estado_exportacion(clave)
+    if estado and not estado["terminado"]: _avance_exportacion(clave)
+    elif estado: _resultado_exportacion(estado, clave)
 
 def view_busqueda():
     st.title("🔍 Explorador de Registros")
-    df = get_data()
-    if not df.empty:
-        q = st.text_input("Buscar por nombre, cédula o municipio...").upper()
+    df, generacion = get_snapshot()
+    if df.empty: return
+    q = st.text_input("Buscar por nombre, cédula, teléfono, barrio o municipio...")
+    c_modo, c_cols = st.columns([1, 3])
+    modo = c_modo.radio("Coincidencia", ["Contiene", "Empieza por"], horizontal=True)
+    columnas = c_cols.multiselect("Columnas", list(df.columns),
+                                  default=[c for c in COLUMNAS_RESULTADO if c in df.columns]) or list(df.columns)
+    c_orden, c_dir, c_tam = st.columns([2, 1, 1])
+    orden = c_orden.selectbox("Ordenar por", columnas,
+                              index=columnas.index("Fecha Registro") if "Fecha Registro" in columnas else 0)
+    descendente = c_dir.toggle("Descendente", value=True)
+    tamano = c_tam.selectbox("Filas por página", TAMANOS_PAGINA, index=1)
+
+    # Las posiciones ordenadas se memorizan por sesión: pasar de página no vuelve a buscar ni ordenar.
+    # Filas anexadas en la misma generación solo refrescan el resultado; la página se conserva (acotada)
+    clave = (generacion, q, modo, orden, descendente)
+    memo = st.session_state.get("busqueda_memo")
+    if not memo or memo[0] != clave or memo[1] != len(df):
         if q:
-            res = df[df.astype(str).apply(lambda x: q in x.str.upper().values, axis=1)]
-            st.dataframe(res, use_container_width=True, hide_index=True)
+            indice = get_indice_busqueda()
+            # Desde la primera búsqueda el índice sigue al publicador en segundo plano
+            get_backend().publicador.suscribir("busqueda", indice.sincronizar)
+            indice.sincronizar(df, generacion)
+            posiciones = indice.buscar(q, "prefijo" if modo == "Empieza por" else "contiene")
+            posiciones = posiciones[posiciones < len(df)]  # El índice puede ir adelantado a esta copia
         else:
-            st.dataframe(df.tail(100), use_container_width=True, hide_index=True)
+            posiciones = np.arange(len(df))
+        if not memo or memo[0] != clave: st.session_state.busqueda_pagina = 1
+        memo = (clave, len(df), ordenar_posiciones(df, posiciones, orden, descendente))
+        st.session_state.busqueda_memo = memo
+    posiciones = memo[2]
 
-# --- 7. EJECUCIÓN PRINCIPAL ---
+    paginas = max(1, -(-len(posiciones) // tamano))
+    if st.session_state.get("busqueda_pagina", 1) > paginas: st.session_state.busqueda_pagina = paginas
+    pagina = st.number_input("Página", min_value=1, max_value=paginas, step=1, key="busqueda_pagina")
+    st.caption(f"{len(posiciones):,} registros · página {pagina} de {paginas}")
+    st.dataframe(pagina_resultados(df, posiciones, columnas, pagina, tamano), use_container_width=True, hide_index=True)
+    with st.expander("⬇️ Exportar resultados"):
+        panel_exportacion(df, posiciones, columnas, "exportar_busqueda")
+
+# --- 9. EJECUCIÓN PRINCIPAL ---
 if __name__ == "__main__":
     apply_custom_styles()
     
@@ -457,13 +2924,27 @@ if __name__ == "__main__":
             </div>
         """, unsafe_allow_html=True)
         
-        opciones = ["📝 Registro", "📊 Estadísticas", "🔍 Búsqueda"] if es_admin else ["📝 Registro"]
+        if es_admin: opciones = ["📝 Registro", "📥 Importar", "📊 Estadísticas", "🔍 Búsqueda"]
+        elif st.session_state.get("is_guest", False): opciones = ["📝 Registro"]
+        else: opciones = ["📝 Registro", "📥 Importar"]
         opcion = st.sidebar.radio("MENÚ PRINCIPAL", opciones)
         
+        if es_admin:
+            estado_cola = get_cola_escritura().estado()
+            with st.sidebar.expander("📤 Cola de escritura"):
+                st.metric("Pendientes", estado_cola["profundidad"])
+                lat = estado_cola["latencia_flush_seg"]
+                st.metric("Latencia último envío", f"{lat:.2f} s" if lat is not None else "—")
+                if estado_cola["fallos_consecutivos"]:
+                    st.warning(f"Reintentando ({estado_cola['fallos_consecutivos']}): {estado_cola['ultimo_error']}")
+            with st.sidebar.expander("⏱️ Rendimiento"):
+                panel_rendimiento()
+
         if st.sidebar.button("Cerrar Sesión"):
             st.session_state.clear()
             st.rerun()
 
         if opcion == "📝 Registro": view_registro()
+        elif opcion == "📥 Importar": view_importacion()
         elif opcion == "📊 Estadísticas": view_estadisticas()
         elif opcion == "🔍 Búsqueda": view_busqueda()
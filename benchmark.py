@@ -0,0 +1,439 @@
+"""Benchmark reproducible del pipeline de datos de Pulse Analytics.
+
+Genera registros sintéticos con la forma de la hoja real (distribución de
+municipios del Valle y de líderes sesgada, fechas crecientes hacia el cierre
+de campaña, ciudades escritas con variantes y errores) y los sirve con una
+hoja de cálculo falsa en memoria, de modo que todo corre sin credenciales ni
+red. Mide cada etapa y la compara con una línea base guardada.
+
+Uso:
+    python benchmark.py                          # 1k, 10k y 100k filas
+    python benchmark.py --filas 1000,1000000     # tamaños a medir
+    python benchmark.py --guardar-base           # fija la línea base actual
+    python benchmark.py --tolerancia 0.40        # regresión si empeora >40 %
+
+Sale con código 1 si alguna etapa supera la línea base más la tolerancia. Cada
+tiempo es el mínimo de las repeticiones; con menos de REPETICIONES_MINIMAS solo
+se informa. Las etapas con latencia simulada (time.sleep en hilos) dependen del
+planificador: sus tiempos se muestran sin umbral y se vigilan sus solicitudes.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import streamlit.logger
+
+streamlit.logger.set_log_level("error")  # Sin avisos de "bare mode" al importar la app
+import app  # noqa: E402
+
+RUTA_BASE = os.path.join(app.DIR_APP, "benchmark_baseline.json")
+FILAS_POR_DEFECTO = "1000,10000,100000"
+DELTA_FILAS = 500
+CONSULTAS = ["CALI", "MARTINEZ", "310", "BARRIO 1", "ANA"]
+
+# Peso aproximado por población; el resto de municipios se reparte por igual
+PESOS_MUNICIPIO = {
+    "CALI": 0.45, "PALMIRA": 0.06, "BUENAVENTURA": 0.06, "TULUÁ": 0.045,
+    "CARTAGO": 0.03, "GUADALAJARA DE BUGA": 0.025, "JAMUNDÍ": 0.025, "YUMBO": 0.02,
+}
+LIDERES = 40
+NOMBRES = ["ANA", "LUIS", "MARIA", "JOSE", "CARLOS", "LUZ", "JORGE", "SANDRA", "JUAN", "DIANA",
+           "ANDRES", "PAOLA", "DIEGO", "CLAUDIA", "JULIAN", "MONICA", "FELIPE", "GLORIA"]
+APELLIDOS = ["GOMEZ", "RODRIGUEZ", "MARTINEZ", "LOPEZ", "GARCIA", "HERNANDEZ", "MORENO",
+             "RAMIREZ", "TORRES", "ROJAS", "VARGAS", "CASTRO", "OSPINA", "CARDONA", "VALENCIA"]
+OCUPACIONES = ["INDEPENDIENTE", "EMPLEADO", "ESTUDIANTE", "HOGAR", "DOCENTE", "COMERCIANTE",
+               "PENSIONADO", "CONDUCTOR", "ENFERMERA", "AGRICULTOR"]
+DIAS_CAMPANA = 180
+RUIDO_SEG = 0.05  # Diferencias menores a esto no cuentan como regresión
+REPETICIONES_MINIMAS = 3  # Por debajo, la comparación con la línea base no falla la corrida
+LATENCIA_API_SEG = 0.02  # Ida y vuelta simulada en la etapa de hojas fragmentadas
+
+
+# --- GENERADOR SINTÉTICO ---
+def _variante(ciudad, rng):
+    """Escribe el municipio como lo haría un usuario: minúsculas, sin tildes, sufijos, errores."""
+    r = rng.random()
+    if r < 0.05: return ciudad.lower()
+    if r < 0.10: return app.normalizar(ciudad)
+    if r < 0.13: return f"{ciudad} V."
+    if r < 0.15 and len(ciudad) > 4:
+        i = int(rng.integers(1, len(ciudad) - 1))
+        return ciudad[:i] + ciudad[i + 1] + ciudad[i] + ciudad[i + 2:]
+    return ciudad
+
+def generar_registros(n, semilla=7, fin=None):
+    """Lista de filas (texto, como las devuelve la hoja) con las columnas de COLUMNAS_REGISTRO."""
+    rng = np.random.default_rng(semilla)
+    etiquetas = app.get_etiquetas_geo()
+    municipios = [app.normalizar(m) for m in etiquetas["ID_MPIO"]] if etiquetas is not None else list(PESOS_MUNICIPIO)
+    oficiales = {app.normalizar(k): k for k in PESOS_MUNICIPIO}
+    municipios = [oficiales.get(m, m) for m in municipios]
+    resto = (1 - sum(PESOS_MUNICIPIO.values())) / max(len(municipios) - len(PESOS_MUNICIPIO), 1)
+    pesos = np.array([PESOS_MUNICIPIO.get(m, resto) for m in municipios])
+    ciudades = rng.choice(len(municipios), size=n, p=pesos / pesos.sum())
+    variantes = {i: [_variante(municipios[i], rng) for _ in range(8)] for i in range(len(municipios))}
+    elegida = rng.integers(0, 8, size=n)
+
+    zipf = 1 / np.arange(1, LIDERES + 1) ** 1.1
+    lideres = rng.choice(LIDERES, size=n, p=zipf / zipf.sum())
+
+    fin = pd.Timestamp(fin or pd.Timestamp.now().floor("s"))
+    # Ritmo creciente: más registros cerca del cierre de campaña
+    segundos = np.sqrt(rng.random(n)) * DIAS_CAMPANA * 86400
+    fechas = (fin - pd.to_timedelta(DIAS_CAMPANA * 86400 - segundos, unit="s")).sort_values()
+    fechas = fechas.strftime("%Y-%m-%d %H:%M:%S")
+
+    cedulas = rng.permutation(n) + 10_000_000
+    telefonos = rng.integers(3_000_000_000, 3_249_999_999, size=n)
+    nombres = rng.integers(0, len(NOMBRES), size=n)
+    apellidos = rng.integers(0, len(APELLIDOS), size=(n, 2))
+    ocupaciones = rng.integers(0, len(OCUPACIONES), size=n)
+    barrios = rng.integers(1, 60, size=n)
+    return [[
+        fechas[i], f"LIDER {lideres[i] + 1:02d}",
+        f"{NOMBRES[nombres[i]]} {APELLIDOS[apellidos[i, 0]]} {APELLIDOS[apellidos[i, 1]]}",
+        str(cedulas[i]), str(telefonos[i]), OCUPACIONES[ocupaciones[i]],
+        f"CALLE {barrios[i] * 3} # {i % 90}-{i % 70}", f"BARRIO {barrios[i]}",
+        variantes[ciudades[i]][elegida[i]], f"PUESTO {ciudades[i] % 12 + 1}",
+    ] for i in range(n)]
+
+
+# --- HOJA DE CÁLCULO FALSA ---
+class HojaFalsa:
+    """Subconjunto de gspread.Worksheet usado por la app, sobre una lista en memoria.
+
+    `latencia` simula la ida y vuelta a la API en cada solicitud."""
+    def __init__(self, filas, encabezados=None, title="Hoja 1", index=0, latencia=0.0):
+        self.valores = [list(encabezados or app.COLUMNAS_REGISTRO)] + [list(f) for f in filas]
+        self.title, self.index, self.latencia = title, index, latencia
+        self.solicitudes = 0
+
+    def _solicitud(self):
+        self.solicitudes += 1
+        if self.latencia: time.sleep(self.latencia)
+
+    def get_all_values(self):
+        self._solicitud()
+        return [list(f) for f in self.valores]
+
+    def get_all_records(self):
+        encabezados, *filas = self.get_all_values()
+        return [dict(zip(encabezados, f)) for f in filas]
+
+    def get(self, rango):
+        """Rangos 'A{n}:{col}' abiertos hacia abajo o 'A{n}:{col}{m}', como los pide CargadorIncremental."""
+        self._solicitud()
+        return self._rango(rango)
+
+    def _rango(self, rango):
+        inicio, _, fin = rango.partition(":")
+        inicio, fin = (int("".join(c for c in x if c.isdigit()) or 0) for x in (inicio, fin))
+        return [list(f) for f in self.valores[inicio - 1:fin or None]]
+
+    def append_rows(self, filas, value_input_option=None):
+        self._solicitud()
+        self.valores.extend(list(f) for f in filas)
+
+class LibroFalso:
+    """Subconjunto de gspread.Spreadsheet: varias hojas y lectura por lotes."""
+    def __init__(self, hoja, latencia=0.0):
+        self.sheet1 = hoja
+        self.hojas = [hoja]
+        self.latencia = latencia
+        self.solicitudes = 0
+
+    def _solicitud(self):
+        self.solicitudes += 1
+        if self.latencia: time.sleep(self.latencia)
+
+    def worksheets(self):
+        self._solicitud()
+        return list(self.hojas)
+
+    def worksheet(self, nombre):
+        for h in self.hojas:
+            if h.title == nombre: return h
+        raise app.gspread.exceptions.WorksheetNotFound(nombre)
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self._solicitud()
+        hoja = HojaFalsa([], title=title, index=len(self.hojas), latencia=self.latencia)
+        hoja.valores = []  # Hoja nueva: sin encabezados hasta el primer append
+        self.hojas.append(hoja)
+        return hoja
+
+    def values_batch_get(self, ranges, params=None):
+        self._solicitud()
+        salida = []
+        for rango in ranges:
+            titulo, _, a1 = rango.rpartition("!")
+            salida.append({"range": rango, "values": self.worksheet(titulo.strip("'"))._rango(a1)})
+        return {"valueRanges": salida}
+
+    def solicitudes_totales(self):
+        return self.solicitudes + sum(h.solicitudes for h in self.hojas)
+
+class ClienteFalso:
+    """Reemplazo de gspread.Client: open() siempre devuelve el mismo libro."""
+    def __init__(self, hoja): self.libro = LibroFalso(hoja)
+    def open(self, _nombre): return self.libro
+
+
+# --- ETAPAS ---
+def _medir(funcion, repeticiones):
+    """(mínimo de los tiempos, último resultado); el mínimo es lo que menos mueve el ruido.
+
+    Como timeit, apaga el recolector de ciclos durante cada repetición: si no,
+    una pasada completa cae en una repetición u otra según lo que quedó de la
+    etapa anterior."""
+    tiempos, resultado = [], None
+    for _ in range(repeticiones):
+        gc.collect()
+        gc.disable()
+        try:
+            t0 = time.perf_counter()
+            resultado = funcion()
+            tiempos.append(time.perf_counter() - t0)
+        finally: gc.enable()
+    return min(tiempos), resultado
+
+def medir_tamano(n, repeticiones, geojson, etiquetas):
+    filas = generar_registros(n)
+    extra = generar_registros(DELTA_FILAS, semilla=11)
+    r = {}
+
+    def carga():
+        hoja = ClienteFalso(HojaFalsa(filas)).open(app.NOMBRE_HOJA).sheet1
+        return hoja, app.CargadorIncremental().obtener(hoja)
+    r["carga"], (hoja, (df, gen)) = _medir(carga, repeticiones)
+
+    def delta():
+        h = HojaFalsa(filas)
+        cargador = app.CargadorIncremental()
+        cargador.obtener(h)
+        h.append_rows(extra)
+        cargador.ultimo_delta = cargador.ultimo_resync - app.INTERVALO_DELTA_SEG  # Toca delta, no recarga
+        t0 = time.perf_counter()
+        cargador._consultar(h, False)
+        transcurrido = time.perf_counter() - t0
+        assert len(cargador.df) == n + DELTA_FILAS and h.solicitudes == 3
+        return transcurrido
+    r["delta"] = min(delta() for _ in range(repeticiones))
+
+    def kpis():
+        agregados = app.AgregadosKPI()
+        agregados.sincronizar(df, gen)
+        ahora = df["Fecha Registro"].max()  # Mismas consultas que _datos_kpis y el leaderboard
+        agregados.conteo_rango(ahora.normalize(), ahora.normalize() + pd.Timedelta(days=1))
+        agregados.conteo_rango(ahora - pd.Timedelta(days=8))
+        agregados.conteo_rango(ahora - pd.Timedelta(days=30))
+        agregados.tabla(agregados.por_lider, ["Líder", "Total"], 8)
+        return agregados
+    r["kpis"], agregados = _medir(kpis, repeticiones)
+
+    def tendencia():
+        inicio, fin = agregados.extension()
+        for desde in (inicio, fin - pd.Timedelta(days=7)):  # Campaña completa y zoom a una semana
+            frecuencia = app.elegir_frecuencia(desde, fin)
+            app.reducir_serie(agregados.serie(frecuencia, desde, fin))
+    r["tendencia"], _ = _medir(tendencia, repeticiones)
+
+    def cubo():
+        resolvedor = app.ResolvedorMunicipios(zip(etiquetas["MPIO_CCNCT"], etiquetas["ID_MPIO"]), app.MAPEO_MUNICIPIOS)
+        cubo = app.CuboRegistros(lambda: resolvedor)
+        cubo.sincronizar(df, gen)
+        semana = df["Fecha Registro"].max() - pd.Timedelta(days=7)
+        for lider in agregados.tabla(agregados.por_lider, ["Líder", "Total"], 5)["Líder"]:  # Detalle de los principales
+            cubo.agregar(["codigo"], lider=lider, desde=semana)
+            cubo.agregar(["dia"], lider=lider)
+    r["cubo"], _ = _medir(cubo, repeticiones)
+
+    def mapa_datos():
+        resolvedor = app.ResolvedorMunicipios(zip(etiquetas["MPIO_CCNCT"], etiquetas["ID_MPIO"]), app.MAPEO_MUNICIPIOS)
+        por_ciudad = agregados.tabla(agregados.por_ciudad, ["Ciudad", "Registros"])
+        return app.conteo_por_municipio(por_ciudad, resolvedor)
+    r["mapa_datos"], counts = _medir(mapa_datos, repeticiones)
+
+    def figura():
+        return app.construir_figura_mapa(counts, geojson, etiquetas).to_json()
+    r["figura"], payload = _medir(figura, repeticiones)
+
+    nivel = app.elegir_nivel_geo(app.ALTO_MAPA_PX)
+    app.figura_mapa_cacheada(counts, nivel)  # Primer visitante: construye y guarda el JSON
+    r["figura_cacheada"], _ = _medir(lambda: app.figura_mapa_cacheada(counts, nivel), repeticiones)
+
+    consultas = []
+
+    def busqueda():
+        indice = app.IndiceBusqueda()
+        indice.sincronizar(df, gen)
+        t0 = time.perf_counter()
+        for q in CONSULTAS:
+            indice.buscar(q)
+            indice.buscar(q, modo="prefijo")
+        consultas.append(time.perf_counter() - t0)
+    r["indice_busqueda"], _ = _medir(busqueda, repeticiones)
+    r["consultas_busqueda"] = min(consultas)
+
+    return {
+        "tiempos": r,
+        "contadores": {"solicitudes_hoja": hoja.solicitudes, "bytes_figura": len(payload),
+                       "municipios_sin_codigo": int(counts["MPIO_CCNCT"].isna().sum())},
+    }
+
+def medir_fragmentos(n, repeticiones):
+    """Lectura de un libro fragmentado por mes: carga inicial en paralelo y refresco
+    sin cambios (solo lista de hojas y testigos), con latencia de API simulada.
+
+    Los tiempos van en "latencia" (informativos) y miden la carga con snapshots
+    de fragmento ya escritos; lo que se compara con la línea base son las
+    solicitudes del arranque en frío y del refresco, que no dependen del
+    planificador."""
+    filas = generar_registros(n)
+    original = app.get_libro, app.DIR_FRAGMENTOS
+
+    def preparar():
+        libro = LibroFalso(HojaFalsa([], latencia=LATENCIA_API_SEG), latencia=LATENCIA_API_SEG)
+        app.get_libro = lambda: libro
+        backend = app.BackendHojasFragmentadas("mes")
+        backend.anexar_filas(filas)
+        return libro, backend
+
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            app.DIR_FRAGMENTOS = d
+            libro, backend = preparar()
+            fragmentos = len(libro.hojas) - 1
+            def carga():
+                b = app.BackendHojasFragmentadas("mes")
+                df, _ = b.leer()
+                assert len(df) == n
+                return b
+            antes = libro.solicitudes_totales()
+            carga()  # Arranque en frío: sin snapshots de fragmento, lee cada hoja completa
+            por_carga = libro.solicitudes_totales() - antes
+            t_carga, backend = _medir(carga, repeticiones)
+            antes = libro.solicitudes_totales()
+            t_refresco, _ = _medir(backend.leer, repeticiones)
+            por_refresco = (libro.solicitudes_totales() - antes) // repeticiones
+    finally:
+        app.get_libro, app.DIR_FRAGMENTOS = original
+    return {"latencia": {"carga": t_carga, "refresco_sin_cambios": t_refresco},
+            "contadores": {"fragmentos": fragmentos, "solicitudes_carga": por_carga,
+                           "solicitudes_refresco": por_refresco}}
+
+def medir_geo(repeticiones):
+    """Construcción del artefacto departamental y simplificación por niveles."""
+    def construir():
+        with tempfile.TemporaryDirectory() as d:
+            app.DIR_GEO = d
+            app.construir_artefacto_geo(app.DPTO_VALLE)
+            decimales = max(app.DECIMALES_GEO)
+            tamanos = {n: os.path.getsize(app._ruta_nivel_geo(app.DPTO_VALLE, (n, decimales))) for n in app.NIVELES_GEO}
+            tamanos["mapa"] = os.path.getsize(app._ruta_nivel_geo(app.DPTO_VALLE, app.elegir_nivel_geo(app.ALTO_MAPA_PX)))
+            return tamanos
+    original = app.DIR_GEO
+    try: t, tamanos = _medir(construir, repeticiones)
+    finally: app.DIR_GEO = original
+    return {"tiempos": {"geojson": t}, "contadores": {f"bytes_{n}": b for n, b in tamanos.items()}}
+
+
+# --- LÍNEA BASE ---
+def calibrar(repeticiones=5):
+    """Tiempo de una carga fija (bucle Python, ordenamiento y agrupación de pandas).
+
+    La velocidad de la máquina cambia entre corridas; la línea base se escala
+    por el cociente de calibraciones antes de comparar."""
+    rng = np.random.default_rng(3)
+    claves, valores = rng.integers(0, 1000, 200_000), rng.random(200_000)
+
+    def carga_fija():
+        sum(i * i for i in range(300_000))
+        np.sort(valores)
+        pd.DataFrame({"k": claves, "v": valores}).groupby("k")["v"].sum()
+    return _medir(carga_fija, repeticiones)[0]
+
+def comparar(resultados, base, tolerancia, escala=1.0):
+    """Imprime la tabla de tiempos y devuelve la lista de regresiones.
+
+    Regresión: un tiempo de "tiempos" por encima de la tolerancia y de RUIDO_SEG,
+    o un contador de solicitudes mayor que el de la línea base. Los tiempos de
+    "latencia" se imprimen sin umbral. `escala` multiplica los tiempos base."""
+    regresiones = []
+    print(f"{'tamaño':>10} {'etapa':<20} {'seg':>10} {'base':>10} {'Δ':>8}")
+    for tamano, datos in resultados.items():
+        previo = base.get(tamano, {})
+        for clave in ("tiempos", "latencia"):
+            for etapa, seg in datos.get(clave, {}).items():
+                ref = previo.get(clave, {}).get(etapa)
+                if ref and clave == "tiempos": ref *= escala
+                cambio = f"{(seg / ref - 1) * 100:+.0f}%" if ref else "-"
+                marca = "  (sin umbral)" if clave == "latencia" else ""
+                if clave == "tiempos" and ref and seg > ref * (1 + tolerancia) and seg - ref > RUIDO_SEG:
+                    regresiones.append((tamano, etapa))
+                    marca = "  ⚠"
+                print(f"{tamano:>10} {etapa:<20} {seg:>10.4f} {ref if ref else float('nan'):>10.4f} {cambio:>8}{marca}")
+        for nombre, valor in datos.get("contadores", {}).items():
+            ref = previo.get("contadores", {}).get(nombre)
+            marca = ""
+            if nombre.startswith("solicitudes_") and ref is not None and valor > ref:
+                regresiones.append((tamano, nombre))
+                marca = f"  ⚠ base {ref}"
+            print(f"{tamano:>10} {nombre:<20} {valor:>10}{marca}")
+    return regresiones
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filas", default=FILAS_POR_DEFECTO, help="tamaños separados por coma")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--base", default=RUTA_BASE)
+    parser.add_argument("--guardar-base", action="store_true")
+    parser.add_argument("--tolerancia", type=float, default=0.30)
+    args = parser.parse_args(argv)
+
+    geojson = app.get_geojson_dpto(app.DPTO_VALLE, app.elegir_nivel_geo(app.ALTO_MAPA_PX))
+    etiquetas = app.get_etiquetas_geo()
+    if geojson is None or etiquetas is None:
+        print("No se pudo cargar la geometría del departamento", file=sys.stderr)
+        return 2
+
+    calibracion = calibrar()
+    resultados = {"geo": medir_geo(args.repeticiones)}
+    for n in (int(x) for x in args.filas.split(",") if x.strip()):
+        resultados[str(n)] = medir_tamano(n, args.repeticiones, geojson, etiquetas)
+        resultados[f"{n}_fragmentos"] = medir_fragmentos(n, args.repeticiones)
+
+    calibracion = min(calibracion, calibrar())  # Al inicio y al final: la más rápida
+    base, escala = {}, 1.0
+    if os.path.exists(args.base):
+        with open(args.base, encoding="utf-8") as f: guardada = json.load(f)
+        base = guardada.get("resultados", {})
+        if guardada.get("calibracion"): escala = calibracion / guardada["calibracion"]
+    print(f"Calibración {calibracion:.4f} s; línea base escalada x{escala:.2f}")
+    regresiones = comparar(resultados, base, args.tolerancia, escala)
+
+    if args.guardar_base:
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump({"maquina": platform.platform(), "python": platform.python_version(),
+                       "pandas": pd.__version__, "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "calibracion": calibracion, "resultados": resultados}, f, ensure_ascii=False, indent=2)
+        print(f"Línea base guardada en {args.base}")
+        return 0
+    if regresiones and args.repeticiones < REPETICIONES_MINIMAS:
+        print(f"{len(regresiones)} etapa(s) sobre la línea base, sin fallar: "
+              f"con menos de {REPETICIONES_MINIMAS} repeticiones la comparación es solo indicativa")
+    elif regresiones:
+        print(f"{len(regresiones)} etapa(s) más lentas que la línea base: {regresiones}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())